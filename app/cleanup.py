@@ -2,10 +2,17 @@
 
 import logging
 import os
+import queue
 import threading
 import time
 
-from app.config import CLEANUP_INTERVAL_SECONDS, CLEANUP_MAX_AGE_SECONDS, DATA_DIR, DB_FILENAME
+from app.config import (
+    CLEANUP_INTERVAL_SECONDS,
+    CLEANUP_MAX_AGE_SECONDS,
+    CLEANUP_MAX_BACKOFF,
+    DATA_DIR,
+    DB_FILENAME,
+)
 
 
 class DataCleanupMonitor:
@@ -14,6 +21,7 @@ class DataCleanupMonitor:
     def __init__(self) -> None:
         self._thread = threading.Thread(target=self._run, daemon=True)
         self._stop_event = threading.Event()
+        self._idle_streak = 0
 
     def start(self) -> None:
         """Запускает фоновый поток очистки."""
@@ -25,18 +33,26 @@ class DataCleanupMonitor:
         self._thread.join(timeout=timeout)
 
     def _run(self) -> None:
-        """Основной цикл: очистка → ожидание интервала."""
+        """Основной цикл: очистка → ожидание интервала.
+
+        Пока удалять нечего, интервал удваивается (до CLEANUP_MAX_BACKOFF раз),
+        после первого же удалённого файла возвращается к базовому.
+        """
         while not self._stop_event.is_set():
-            self._cleanup_data_dir()
-            self._stop_event.wait(CLEANUP_INTERVAL_SECONDS)
+            removed = self._cleanup_data_dir()
+            self._idle_streak = 0 if removed else self._idle_streak + 1
+            factor = min(1 << min(self._idle_streak, 16), max(1, CLEANUP_MAX_BACKOFF))
+            self._stop_event.wait(CLEANUP_INTERVAL_SECONDS * factor)
 
-    def _cleanup_data_dir(self) -> None:
-        """Удаляет файлы старше CLEANUP_MAX_AGE_SECONDS (кроме БД и логов)."""
+    def _cleanup_data_dir(self) -> int:
+        """Удаляет файлы старше CLEANUP_MAX_AGE_SECONDS (кроме БД и логов), возвращает их число."""
+        removed = 0
         now = time.time()
         cutoff = now - CLEANUP_MAX_AGE_SECONDS
         for root, _dirs, files in os.walk(DATA_DIR):
             for filename in files:
-                if filename == DB_FILENAME:
+                # БД и её служебные файлы WAL (-wal, -shm)
+                if filename in (DB_FILENAME, f"{DB_FILENAME}-wal", f"{DB_FILENAME}-shm"):
                     continue
                 # Не удаляем файлы логов
                 if filename.endswith(".log") or filename.endswith(".log.1"):
@@ -48,7 +64,69 @@ class DataCleanupMonitor:
                 try:
                     if os.path.getmtime(path) < cutoff:
                         os.remove(path)
+                        removed += 1
                 except FileNotFoundError:
                     continue
                 except OSError:
                     logging.exception("Не удалось удалить файл %s", path)
+        return removed
+
+
+class FileJanitor:
+    """Удаляет отработанные файлы в фоновом потоке (вне пути отправки)."""
+
+    def __init__(self) -> None:
+        self._queue: queue.Queue[str | None] = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._stopped = False
+        # Проверка _stopped и постановка в очередь — атомарно относительно
+        # stop(): ни один путь не попадёт в очередь после маркера остановки
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """Запускает фоновый поток удаления."""
+        self._thread.start()
+
+    def stop(self, timeout: float = 2.0) -> None:
+        """Удаляет уже поставленные в очередь файлы и останавливает поток."""
+        with self._lock:
+            self._stopped = True
+            self._queue.put(None)
+        if self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+        # Поток не успел (или не был запущен) — дочищаем очередь сами
+        while True:
+            try:
+                path = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if path is not None:
+                self._remove(path)
+        # Маркер мог уйти вместе с очередью — возвращаем, чтобы поток завершился
+        if self._thread.is_alive():
+            self._queue.put(None)
+
+    def discard(self, path: str) -> None:
+        """Ставит файл в очередь на удаление (после stop — удаляет сразу)."""
+        with self._lock:
+            if not self._stopped:
+                self._queue.put(path)
+                return
+        self._remove(path)
+
+    def _run(self) -> None:
+        """Основной цикл: забираем путь из очереди и удаляем файл."""
+        while True:
+            path = self._queue.get()
+            if path is None:
+                break
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logging.exception("Не удалось удалить файл %s", path)
@@ -10,6 +10,8 @@ DATA_DIR = os.getenv("DATA_DIR", "/workspace/NeuronDownloader/data")
 DB_FILENAME = os.getenv("DB_FILENAME", "bot.db")
 CLEANUP_INTERVAL_SECONDS = int(os.getenv("CLEANUP_INTERVAL_SECONDS", "600"))
 CLEANUP_MAX_AGE_SECONDS = int(os.getenv("CLEANUP_MAX_AGE_SECONDS", "18000"))
+# Во сколько раз максимум растягивается интервал очистки, пока удалять нечего
+CLEANUP_MAX_BACKOFF = int(os.getenv("CLEANUP_MAX_BACKOFF", "8"))
 _cookies_file_env = os.getenv("COOKIES_FILE", "").strip()
 COOKIES_FILE = _cookies_file_env if _cookies_file_env else os.path.join(DATA_DIR, "cookies.txt")
 COOKIE_CHECK_INTERVAL_SECONDS = int(os.getenv("COOKIE_CHECK_INTERVAL_SECONDS", "1800"))
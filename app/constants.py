@@ -13,13 +13,30 @@ TELEGRAM_MAX_BUTTONS_PER_KEYBOARD = 100
 
 # --- Настройки повторных попыток загрузки ---
 UPLOAD_MAX_RETRIES = 3
-UPLOAD_RETRY_DELAYS = (2, 5, 10)  # секунды между попытками
+# Экспоненциальная пауза между попытками: BASE * 2^attempt, не больше MAX,
+# плюс случайная добавка до JITTER от паузы (потоки не повторяют в ногу)
+UPLOAD_RETRY_BASE_DELAY = 2.0  # секунды
+UPLOAD_RETRY_MAX_DELAY = 30.0  # секунды
+UPLOAD_RETRY_JITTER = 0.5
+UPLOAD_RETRY_AFTER_MAX = 60  # потолок для паузы из «retry after N» при 429 (секунды)
+
+# --- Буфер чтения файла при отправке в Telegram ---
+UPLOAD_READ_BUFFER_SIZE = 1 << 20  # 1 МБ
 
 # --- Таймаут скачивания (секунды) ---
 DOWNLOAD_TIMEOUT_SECONDS = 600  # 10 минут
 
+# --- Обслуживание БД: PRAGMA optimize + incremental_vacuum (секунды) ---
+DB_OPTIMIZE_INTERVAL_SECONDS = 3600  # 1 час
+
+# --- TTL кэша метаданных yt-dlp (секунды) ---
+# Короткий: прямые ссылки CDN внутри info со временем протухают
+INFO_CACHE_TTL_SECONDS = 120  # 2 минуты
+
 # --- TTL кэша подписок (секунды) ---
 MEMBERSHIP_CACHE_TTL = 300  # 5 минут
+MEMBERSHIP_CACHE_MAX_SIZE = 10_000  # записей (chat_id, user_id)
+MEMBERSHIP_CACHE_SWEEP_MIN_INTERVAL = 60  # минимальный интервал фоновой очистки кэша, секунд
 
 # --- Предпочтительный формат видео (избегаем проблем с webm в Telegram) ---
 PREFERRED_VIDEO_FORMAT = "mp4"
@@ -5,6 +5,7 @@ import logging
 import os
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from app.config import (
     COOKIE_CHECK_INTERVAL_SECONDS,
@@ -73,12 +74,27 @@ class CookieHealthMonitor:
     def _run(self) -> None:
         # Первую проверку делаем через интервал, а не сразу при старте,
         # чтобы не замедлять запуск бота.
-        while not self._stop_event.is_set():
-            self._stop_event.wait(COOKIE_CHECK_INTERVAL_SECONDS)
-            if self._stop_event.is_set():
-                break
-            self._check_youtube()
-            self._check_instagram()
+        # Проверки платформ независимы и упираются в сеть — выполняем их
+        # параллельно: время прохода = самая медленная проверка, а не сумма.
+        pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cookie-check")
+        try:
+            while not self._stop_event.is_set():
+                self._stop_event.wait(COOKIE_CHECK_INTERVAL_SECONDS)
+                if self._stop_event.is_set():
+                    break
+                futures = [
+                    pool.submit(self._check_youtube),
+                    pool.submit(self._check_instagram),
+                ]
+                for future in as_completed(futures):
+                    if self._stop_event.is_set():
+                        break
+                    try:
+                        future.result()
+                    except Exception:
+                        logger.exception("Cookie-check: непредвиденная ошибка")
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
 
     def _check_youtube(self) -> None:
         from app.utils import notify_admin_cookies_expired
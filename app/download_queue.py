@@ -2,14 +2,19 @@
 
 from __future__ import annotations
 
+import logging
 import queue
 import threading
+import time
 
 from concurrent.futures import Future
 from typing import Callable, TypeVar
 
 T = TypeVar("T")
 
+# Не чаще одного предупреждения о переполненной очереди за интервал (секунды)
+_QUEUE_FULL_LOG_INTERVAL = 5.0
+
 
 class DownloadManager:
     """Очередь задач загрузки с ограничением одновременных задач на пользователя."""
@@ -35,21 +40,48 @@ class DownloadManager:
         self._active_counts: dict[int, int] = {}
         self._active_lock = threading.Lock()
         self._active_condition = threading.Condition(self._active_lock)
+        # Отказы из-за переполнения: копим и логируем сводкой
+        self._rejected = 0
+        self._rejected_last_log = 0.0
+        self._rejected_lock = threading.Lock()
         for worker in self._workers:
             worker.start()
 
     def submit(self, func: Callable[..., T], *args, **kwargs) -> Future[T]:
         """Добавляет задачу в очередь без привязки к пользователю."""
         future: Future[T] = Future()
-        self._queue.put_nowait((func, args, kwargs, future, None))
+        try:
+            self._queue.put_nowait((func, args, kwargs, future, None))
+        except queue.Full:
+            self._note_rejected()
+            raise
         return future
 
     def submit_user(self, user_id: int, func: Callable[..., T], *args, **kwargs) -> Future[T]:
         """Добавляет задачу в очередь с привязкой к пользователю."""
         future: Future[T] = Future()
-        self._queue.put_nowait((func, args, kwargs, future, user_id))
+        try:
+            self._queue.put_nowait((func, args, kwargs, future, user_id))
+        except queue.Full:
+            self._note_rejected()
+            raise
         return future
 
+    def _note_rejected(self) -> None:
+        """Учитывает отказ по переполнению; в лог — не чаще раза в интервал."""
+        now = time.monotonic()
+        with self._rejected_lock:
+            self._rejected += 1
+            if now - self._rejected_last_log < _QUEUE_FULL_LOG_INTERVAL:
+                return
+            rejected = self._rejected
+            self._rejected = 0
+            self._rejected_last_log = now
+        logging.warning(
+            "Очередь загрузок переполнена (%d/%d): отклонено задач — %d",
+            self._queue.qsize(), self._max_queue_size, rejected,
+        )
+
     def queued_count(self) -> int:
         """Возвращает текущий размер очереди."""
         return self._queue.qsize()
@@ -95,10 +127,11 @@ class DownloadManager:
                     self._active_condition.notify_all()
             self._queue.task_done()
 
-    def shutdown(self, timeout: float = 2.0) -> None:
-        """Останавливает все рабочие потоки."""
+    def shutdown(self, timeout: float = 2.0) -> bool:
+        """Останавливает все рабочие потоки; True, если все успели завершиться."""
         self._stop_event.set()
         with self._active_condition:
             self._active_condition.notify_all()
         for worker in self._workers:
             worker.join(timeout=timeout)
+        return not any(worker.is_alive() for worker in self._workers)
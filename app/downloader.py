@@ -5,6 +5,7 @@ import logging
 import os
 import re
 import subprocess
+import threading
 import time
 from dataclasses import dataclass
 from collections.abc import Callable
@@ -21,7 +22,8 @@ from app.config import (
     YOUTUBE_JS_RUNTIME_PATH,
     YOUTUBE_PLAYER_CLIENTS,
 )
-from app.constants import PREFERRED_VIDEO_FORMAT
+from app.constants import INFO_CACHE_TTL_SECONDS, PREFERRED_VIDEO_FORMAT
+from app.utils import stat_file
 
 # Наборы player_client для повторных попыток YouTube.
 # Если первая попытка с текущими настройками провалилась с
@@ -226,7 +228,8 @@ def ensure_h264(file_path: str) -> tuple[str, bool, str | None]:
             pass
         return file_path, False, codec
 
-    if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+    output_stat = stat_file(output_path)
+    if output_stat is None or output_stat.st_size == 0:
         logging.error("Перекодированный файл пустой или отсутствует: %s", output_path)
         try:
             os.remove(output_path)
@@ -320,7 +323,8 @@ def download_thumbnail(url: str | None, data_dir: str) -> str | None:
             except OSError:
                 pass
 
-        if os.path.exists(thumb_path) and os.path.getsize(thumb_path) > 0:
+        thumb_stat = stat_file(thumb_path)
+        if thumb_stat is not None and thumb_stat.st_size > 0:
             return thumb_path
 
     except Exception:
@@ -361,6 +365,9 @@ class VideoDownloader:
         self.data_dir = data_dir
         os.makedirs(self.data_dir, exist_ok=True)
         self.cookiefile = self._prepare_cookiefile()
+        # url -> (info, момент истечения по time.monotonic())
+        self._info_cache: dict[str, tuple[dict, float]] = {}
+        self._info_lock = threading.Lock()
 
     def reload_cookies(self) -> str | None:
         """Перечитывает файл cookies с диска (после обновления)."""
@@ -511,6 +518,31 @@ class VideoDownloader:
             # (SABR/PO-token/age-gate затрагивают разных клиентов по-разному).
             return self._retry_with_fallback_clients(url, opts, exc)
 
+    def get_info_cached(self, url: str) -> dict:
+        """get_info с кэшем на INFO_CACHE_TTL_SECONDS (ошибки не кэшируются).
+
+        Между показом клавиатуры качества и подготовкой загрузки проходят
+        секунды — повторный запуск yt-dlp для той же ссылки не нужен.
+        """
+        now = time.monotonic()
+        with self._info_lock:
+            entry = self._info_cache.get(url)
+            if entry is not None and entry[1] > now:
+                return entry[0]
+        info = self.get_info(url)
+        now = time.monotonic()
+        with self._info_lock:
+            # Заодно выбрасываем протухшие записи, чтобы кэш не рос
+            for key in [k for k, (_i, exp) in self._info_cache.items() if exp <= now]:
+                del self._info_cache[key]
+            self._info_cache[url] = (info, now + INFO_CACHE_TTL_SECONDS)
+        return info
+
+    def invalidate_info(self, url: str) -> None:
+        """Удаляет метаданные ссылки из кэша (например, протухла прямая ссылка)."""
+        with self._info_lock:
+            self._info_cache.pop(url, None)
+
     def _retry_with_fallback_clients(
         self,
         url: str,
@@ -907,7 +939,8 @@ class VideoDownloader:
                     ],
                     capture_output=True, timeout=120,
                 )
-                if os.path.exists(part_path) and os.path.getsize(part_path) > 0:
+                part_stat = stat_file(part_path)
+                if part_stat is not None and part_stat.st_size > 0:
                     parts.append(part_path)
                 else:
                     logging.warning("Часть %d пуста или отсутствует: %s", i + 1, part_path)
@@ -105,11 +105,9 @@ def register_admin_handlers(ctx) -> None:
     # ------------------------------------------------------------------
 
     def _show_users_page(chat_id: int, message_id: int, page: int):
-        all_users = storage.list_users()
-        total_pages = max(1, math.ceil(len(all_users) / USERS_PER_PAGE))
+        total_pages = max(1, math.ceil(storage.count_users() / USERS_PER_PAGE))
         page = max(0, min(page, total_pages - 1))
-        start = page * USERS_PER_PAGE
-        page_users = all_users[start:start + USERS_PER_PAGE]
+        page_users = storage.list_users(USERS_PER_PAGE, page * USERS_PER_PAGE)
         user_stats = storage.get_user_stats()
         download_counts = {uid: count for uid, count in user_stats}
         markup = build_admin_users_page(page_users, page, total_pages, download_counts)
@@ -1250,8 +1248,17 @@ def register_admin_handlers(ctx) -> None:
         def _process() -> None:
             sent = 0
             failed = 0
+            skipped = 0
+            # Повторные запросы той же ссылки тем же пользователем запускаем один раз
+            seen: set[tuple[int, str]] = set()
             for row in pending:
-                pid, uid, cid, url, platform, created_at = row
+                pid, uid, cid, url, platform, created_at, blocked = row
+                # Заблокированным не пишем и не запускаем подготовку загрузки
+                if blocked or (uid, url) in seen:
+                    storage.delete_pending_cookie_download(pid)
+                    skipped += 1
+                    continue
+                seen.add((uid, url))
                 try:
                     bot.send_message(
                         cid,
@@ -1276,7 +1283,8 @@ def register_admin_handlers(ctx) -> None:
             bot.send_message(
                 admin_chat_id,
                 f"📋 Отложенные загрузки обработаны.\n"
-                f"Запущено: {sent}\nОшибок: {failed}",
+                f"Запущено: {sent}\nОшибок: {failed}\n"
+                f"Пропущено (блокировка или повтор): {skipped}",
             )
 
         threading.Thread(target=_process, daemon=True).start()
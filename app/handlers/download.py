@@ -81,6 +81,7 @@ from app.utils import (
     is_youtube_url,
     notify_admin_cookies_expired,
     notify_admin_error,
+    open_for_upload,
     send_with_retry,
 )
 
@@ -92,6 +93,7 @@ def register_download_handlers(ctx) -> None:
     downloader = ctx.downloader
     download_manager = ctx.download_manager
     active_downloads = ctx.active_downloads
+    file_janitor = ctx.file_janitor
 
     # Эффективные лимиты: локальный Bot API Server (2000 МБ) или стандартный (50 МБ)
     use_local_api = bool(TELEGRAM_API_SERVER_URL)
@@ -351,7 +353,7 @@ def register_download_handlers(ctx) -> None:
                 direct_url = None
                 direct_size = None
                 try:
-                    direct_info = downloader.get_info(url)
+                    direct_info = downloader.get_info_cached(url)
                     direct_url, direct_size = downloader.get_direct_url(
                         direct_info, selected_format, audio_only=audio_only,
                     )
@@ -402,6 +404,8 @@ def register_download_handlers(ctx) -> None:
                             )
                             return
                         except Exception:
+                            # Прямая ссылка могла протухнуть — не отдаём её из кэша повторно
+                            downloader.invalidate_info(url)
                             logging.exception(
                                 "Отправка по прямой ссылке не удалась, переходим к скачиванию "
                                 "(user=%s, url=%s)", user_id, url,
@@ -479,6 +483,13 @@ def register_download_handlers(ctx) -> None:
         logged_missing_total = [False]
         _progress_msg_id = [progress_message_id]
 
+        def _aborted() -> bool:
+            """Проверка завершения работы между этапами (файл удалит finally)."""
+            if not ctx.shutdown_requested:
+                return False
+            logging.info("Загрузка прервана из-за завершения работы: %s", url)
+            return True
+
         def progress_hook(data: dict) -> None:
             if ctx.shutdown_requested:
                 raise KeyboardInterrupt("Загрузка прервана из-за завершения работы")
@@ -528,7 +539,13 @@ def register_download_handlers(ctx) -> None:
             except Exception:
                 pass
 
+        # Скачанный файл удаляется в finally (через janitor) на любом исходе,
+        # кроме ожидания решения о разделении — тогда он нужен дальше
+        file_path: str | None = None
+        keep_file = False
         try:
+            if _aborted():
+                return
             if _progress_msg_id[0]:
                 try:
                     bot.edit_message_text(
@@ -542,6 +559,8 @@ def register_download_handlers(ctx) -> None:
                 audio_only=audio_only,
                 progress_callback=progress_hook,
             )
+            if _aborted():
+                return
             download_duration = time.monotonic() - download_started
             total_bytes = get_file_size(file_path)
             logging.info(
@@ -604,9 +623,13 @@ def register_download_handlers(ctx) -> None:
                             original_codec, url,
                         )
 
+            if _aborted():
+                return
+
             # Если файл слишком большой, предлагаем разделить
             if total_bytes and total_bytes > max_file_size:
                 split_token = uuid.uuid4().hex[:12]
+                keep_file = True
                 _split_pending[split_token] = {
                     "file_path": file_path,
                     "title": title,
@@ -678,6 +701,9 @@ def register_download_handlers(ctx) -> None:
                     }
                 report_markup = build_video_buttons(report_token, reencode_token)
 
+            if _aborted():
+                return
+
             # Скачиваем превью-картинку для отображения в Telegram
             thumb_path = None
             if not audio_only:
@@ -689,7 +715,7 @@ def register_download_handlers(ctx) -> None:
                 thumb_file = None
                 if thumb_path:
                     thumb_file = open(thumb_path, "rb")
-                with open(file_path, "rb") as handle:
+                with open_for_upload(file_path) as handle:
                     sent_file_id = _send_media(
                         user_id, chat_id, handle, title,
                         audio_only, file_size=total_bytes,
@@ -729,11 +755,6 @@ def register_download_handlers(ctx) -> None:
                 except Exception:
                     logging.exception("Не удалось закэшировать file_id")
 
-            try:
-                os.remove(file_path)
-            except OSError:
-                logging.exception("Не удалось удалить файл %s после отправки", file_path)
-
             if _progress_msg_id[0]:
                 try:
                     bot.delete_message(chat_id, _progress_msg_id[0])
@@ -821,6 +842,8 @@ def register_download_handlers(ctx) -> None:
                     except Exception:
                         pass
         finally:
+            if file_path and not keep_file:
+                file_janitor.discard(file_path)
             active_downloads.release(url)
 
     # --- Обработчики сообщений ---
@@ -1071,7 +1094,7 @@ def register_download_handlers(ctx) -> None:
         reaction_message_id: int | None,
     ) -> None:
         try:
-            info = downloader.get_info(url)
+            info = downloader.get_info_cached(url)
         except Exception as exc:
             error_text = str(exc)
             error_lower = error_text.lower()
@@ -1477,7 +1500,7 @@ def register_download_handlers(ctx) -> None:
                     if split_thumb_path:
                         split_thumb_file = open(split_thumb_path, "rb")
                     try:
-                        with open(part_path, "rb") as handle:
+                        with open_for_upload(part_path) as handle:
                             _send_media(
                                 user_id, chat_id, handle, part_title,
                                 audio_only, file_size=part_size,
@@ -1653,100 +1676,113 @@ def register_download_handlers(ctx) -> None:
                         pass
                     return
 
-                file_path, info = downloader.download(
-                    re_url, re_format, audio_only=False,
-                )
-                total_bytes = get_file_size(file_path)
-                size_mb = (total_bytes or 0) / (1024 * 1024)
-                est_minutes = max(1, int(size_mb * 0.6))
-                try:
-                    bot.edit_message_text(
-                        f"\U0001f504 Перекодируем видео в H.264...\n"
-                        f"\u23f3 Это может занять ~{est_minutes} мин.",
-                        re_chat_id, progress_mid,
+                # Тот же URL уже скачивается — не качаем его параллельно
+                # (в те же файлы) и не делаем работу дважды
+                with active_downloads.acquire(re_url) as acquired:
+                    if not acquired:
+                        try:
+                            bot.edit_message_text(
+                                "Это видео уже скачивается. Дождитесь завершения.",
+                                re_chat_id, progress_mid,
+                            )
+                        except Exception:
+                            pass
+                        return
+
+                    file_path, info = downloader.download(
+                        re_url, re_format, audio_only=False,
                     )
-                except Exception:
-                    pass
-                reencode_start = time.monotonic()
-                file_path, was_reencoded, codec = ensure_h264(file_path)
-                reencode_duration = time.monotonic() - reencode_start
-                total_bytes = get_file_size(file_path)
-                logging.info(
-                    "Перекодирование по запросу за %.2fs (кодек=%s, размер=%s, url=%s)",
-                    reencode_duration, codec,
-                    format_bytes(total_bytes) if total_bytes else "?",
-                    re_url,
-                )
-                if total_bytes and total_bytes > max_file_size:
+                    total_bytes = get_file_size(file_path)
+                    size_mb = (total_bytes or 0) / (1024 * 1024)
+                    est_minutes = max(1, int(size_mb * 0.6))
                     try:
                         bot.edit_message_text(
-                            f"{EMOJI_ERROR} Перекодированный файл слишком большой "
-                            f"({format_bytes(total_bytes)}). Попробуйте меньшее качество.",
+                            f"\U0001f504 Перекодируем видео в H.264...\n"
+                            f"\u23f3 Это может занять ~{est_minutes} мин.",
                             re_chat_id, progress_mid,
                         )
                     except Exception:
                         pass
-                    try:
-                        os.remove(file_path)
-                    except OSError:
-                        pass
-                    return
-                try:
-                    bot.edit_message_text(
-                        f"{EMOJI_DONE} Перекодировано. Отправляем\u2026",
-                        re_chat_id, progress_mid,
+                    reencode_start = time.monotonic()
+                    file_path, was_reencoded, codec = ensure_h264(file_path)
+                    reencode_duration = time.monotonic() - reencode_start
+                    total_bytes = get_file_size(file_path)
+                    logging.info(
+                        "Перекодирование по запросу за %.2fs (кодек=%s, размер=%s, url=%s)",
+                        reencode_duration, codec,
+                        format_bytes(total_bytes) if total_bytes else "?",
+                        re_url,
                     )
-                except Exception:
-                    pass
-                # Скачиваем превью для перекодированного видео
-                re_thumb_path = None
-                thumb_url = info.get("thumbnail")
-                if thumb_url:
-                    re_thumb_path = download_thumbnail(thumb_url, downloader.data_dir)
-
-                try:
-                    re_thumb_file = None
-                    if re_thumb_path:
-                        re_thumb_file = open(re_thumb_path, "rb")
-                    with open(file_path, "rb") as handle:
-                        sent_fid = _send_media(
-                            re_user_id, re_chat_id, handle,
-                            f"{re_title} (H.264)", False,
-                            file_size=total_bytes,
-                            source_url=re_url,
-                            thumbnail=re_thumb_file,
-                        )
-                finally:
-                    if re_thumb_file:
-                        re_thumb_file.close()
-                    if re_thumb_path:
+                    if total_bytes and total_bytes > max_file_size:
+                        try:
+                            bot.edit_message_text(
+                                f"{EMOJI_ERROR} Перекодированный файл слишком большой "
+                                f"({format_bytes(total_bytes)}). Попробуйте меньшее качество.",
+                                re_chat_id, progress_mid,
+                            )
+                        except Exception:
+                            pass
                         try:
-                            os.remove(re_thumb_path)
+                            os.remove(file_path)
                         except OSError:
                             pass
-
-                # Кэшируем перекодированную версию
-                if sent_fid:
+                        return
                     try:
-                        storage.cache_file(
-                            url=re_url,
-                            format_id=re_format,
-                            reencoded=True,
-                            audio_only=False,
-                            telegram_file_id=sent_fid,
-                            codec="h264",
-                            file_size=total_bytes,
+                        bot.edit_message_text(
+                            f"{EMOJI_DONE} Перекодировано. Отправляем\u2026",
+                            re_chat_id, progress_mid,
                         )
                     except Exception:
-                        logging.exception("Не удалось закэшировать перекодированный file_id")
-                try:
-                    os.remove(file_path)
-                except OSError:
-                    pass
-                try:
-                    bot.delete_message(re_chat_id, progress_mid)
-                except Exception:
-                    pass
+                        pass
+                    # Скачиваем превью для перекодированного видео
+                    re_thumb_path = None
+                    thumb_url = info.get("thumbnail")
+                    if thumb_url:
+                        re_thumb_path = download_thumbnail(thumb_url, downloader.data_dir)
+
+                    try:
+                        re_thumb_file = None
+                        if re_thumb_path:
+                            re_thumb_file = open(re_thumb_path, "rb")
+                        with open_for_upload(file_path) as handle:
+                            sent_fid = _send_media(
+                                re_user_id, re_chat_id, handle,
+                                f"{re_title} (H.264)", False,
+                                file_size=total_bytes,
+                                source_url=re_url,
+                                thumbnail=re_thumb_file,
+                            )
+                    finally:
+                        if re_thumb_file:
+                            re_thumb_file.close()
+                        if re_thumb_path:
+                            try:
+                                os.remove(re_thumb_path)
+                            except OSError:
+                                pass
+
+                    # Кэшируем перекодированную версию
+                    if sent_fid:
+                        try:
+                            storage.cache_file(
+                                url=re_url,
+                                format_id=re_format,
+                                reencoded=True,
+                                audio_only=False,
+                                telegram_file_id=sent_fid,
+                                codec="h264",
+                                file_size=total_bytes,
+                            )
+                        except Exception:
+                            logging.exception("Не удалось закэшировать перекодированный file_id")
+                    try:
+                        os.remove(file_path)
+                    except OSError:
+                        pass
+                    try:
+                        bot.delete_message(re_chat_id, progress_mid)
+                    except Exception:
+                        pass
             except Exception as exc:
                 logging.exception("Ошибка перекодировки по запросу: %s", re_url)
                 try:
@@ -35,12 +35,13 @@ from app.downloader import VideoDownloader
 from app.handlers import register_all_handlers
 from app.logger import setup_logging
 from app.storage import Storage
-from app.cleanup import DataCleanupMonitor
+from app.cleanup import DataCleanupMonitor, FileJanitor
 from app.cookie_monitor import CookieHealthMonitor
 from app.utils import (
     ActiveDownloads,
     MembershipCache,
     is_admin,
+    shutdown_retries,
 )
 
 
@@ -55,6 +56,7 @@ class BotContext:
         download_manager: DownloadManager,
         membership_cache: MembershipCache,
         active_downloads: ActiveDownloads,
+        file_janitor: FileJanitor,
     ) -> None:
         self.bot = bot
         self.storage = storage
@@ -62,6 +64,7 @@ class BotContext:
         self.download_manager = download_manager
         self.membership_cache = membership_cache
         self.active_downloads = active_downloads
+        self.file_janitor = file_janitor
         self.shutdown_requested = False
         # Машина состояний пользователя/админа
         self._user_states: dict[int, object] = {}
@@ -230,8 +233,9 @@ class BotContext:
         now_ts = int(datetime.now(timezone.utc).timestamp())
         free_window = self.get_free_window()
         start_ts = now_ts - free_window
-        used = self.storage.count_free_downloads_since(user_id, start_ts)
-        return used >= self.get_free_limit()
+        free_limit = self.get_free_limit()
+        used = self.storage.free_downloads_at_least(user_id, start_ts, free_limit)
+        return used >= free_limit
 
 
 def main() -> None:
@@ -274,7 +278,10 @@ def main() -> None:
         MAX_ACTIVE_TASKS_PER_USER,
     )
     membership_cache = MembershipCache()
+    membership_cache.start()
     active_downloads = ActiveDownloads()
+    file_janitor = FileJanitor()
+    file_janitor.start()
 
     ctx = BotContext(
         bot=bot,
@@ -283,6 +290,7 @@ def main() -> None:
         download_manager=download_manager,
         membership_cache=membership_cache,
         active_downloads=active_downloads,
+        file_janitor=file_janitor,
     )
 
     cleanup_monitor = DataCleanupMonitor()
@@ -295,7 +303,7 @@ def main() -> None:
     register_all_handlers(ctx)
     logging.info(
         "Бот запущен (пользователей: %d, админов: %d, каналов: %d)",
-        len(storage.list_users()),
+        storage.count_users(),
         len(ADMIN_IDS),
         len(REQUIRED_CHAT_IDS),
     )
@@ -321,7 +329,10 @@ def main() -> None:
             bot.stop_polling()
         except Exception as e:
             logging.debug("Ошибка при остановке polling: %s", e)
+        shutdown_retries()
         download_manager.shutdown()
+        file_janitor.stop()
+        membership_cache.stop()
         cleanup_monitor.stop()
         cookie_monitor.stop()
         logging.info("Все компоненты остановлены")
@@ -382,6 +393,13 @@ def main() -> None:
                 logging.error("Ошибка polling: %s", exc)
             time.sleep(delay)
 
+    # БД закрываем последней, когда в неё больше никто не пишет: обработчики
+    # telebot завершены, рабочие потоки загрузок остановлены
+    bot.worker_pool.close()
+    if download_manager.shutdown():
+        storage.close()
+    else:
+        logging.warning("Загрузки ещё выполняются — соединение с БД остаётся открытым до выхода")
     logging.info("Бот завершил работу")
 
 
@@ -1,37 +1,150 @@
 """SQLite-хранилище: пользователи, загрузки, тикеты, настройки."""
 
+import logging
 import os
 import sqlite3
+import threading
+import time
 import uuid
 
+from collections.abc import Iterator
+from contextlib import contextmanager
+from urllib.parse import quote
+
 from app.config import DATA_DIR, DB_FILENAME
+from app.constants import DB_OPTIMIZE_INTERVAL_SECONDS
+
+
+# INSERT ... RETURNING появился в SQLite 3.35
+_MIN_SQLITE_VERSION = (3, 35, 0)
 
 
 class Storage:
     """Хранилище данных бота на SQLite."""
 
     def __init__(self) -> None:
+        if sqlite3.sqlite_version_info < _MIN_SQLITE_VERSION:
+            raise RuntimeError(
+                f"Нужен SQLite {'.'.join(map(str, _MIN_SQLITE_VERSION))}+, "
+                f"установлен {sqlite3.sqlite_version}"
+            )
         os.makedirs(DATA_DIR, exist_ok=True)
         self.db_path = os.path.join(DATA_DIR, DB_FILENAME)
         self._init_db()
         self._migrate_db()
-
-    def _ensure_db(self) -> None:
-        """Проверяет наличие БД и таблиц, при необходимости создаёт."""
-        if not os.path.exists(self.db_path):
-            self._init_db()
-            return
-        with sqlite3.connect(self.db_path) as conn:
-            cur = conn.execute(
-                "SELECT name FROM sqlite_master WHERE type='table' AND name='users'"
+        # Постоянные соединения: одно пишущее и по одному только для чтения
+        # на поток. В режиме WAL читатели не ждут пишущую транзакцию и друг
+        # друга, поэтому чтения не сериализуются ни с записями, ни между собой.
+        # Пишущее соединение одно и защищено блокировкой: все вызывающие
+        # всё равно ждут результат записи, отдельный поток им не нужен.
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        # Строки — обычные кортежи, текст — str: самый быстрый путь выборки
+        # без конвертеров (явно, чтобы внешний код не поменял поведение)
+        self._conn.row_factory = None
+        self._conn.text_factory = str
+        self._write_lock = threading.Lock()
+        self._closed = False
+        self._ro_uri = f"file:{quote(self.db_path)}?mode=ro"
+        self._local = threading.local()
+        # Снимки самых частых чтений: флаг блокировки (проверяется на каждое
+        # сообщение), обязательные каналы (на каждую проверку подписки) и
+        # настройки (на каждую проверку лимита). Меняются только действиями
+        # админа, поэтому читаются из памяти, а set_*/add_*/remove_* правят
+        # и БД, и снимок. upsert_user флаг blocked не меняет.
+        with self._read() as conn:
+            self._blocked: set[int] = {
+                uid for (uid,) in conn.execute("SELECT user_id FROM users WHERE blocked = 1")
+            }
+            self._required_channels: dict[int, tuple[int, str | None, str | None]] = {
+                row[0]: row
+                for row in conn.execute(
+                    "SELECT chat_id, title, invite_link FROM required_channels ORDER BY chat_id"
+                )
+            }
+            self._settings: dict[str, str] = dict(
+                conn.execute("SELECT key, value FROM bot_settings").fetchall()
             )
-            if cur.fetchone() is None:
-                self._init_db()
-
-    def _connect(self) -> sqlite3.Connection:
-        """Возвращает соединение с БД."""
-        self._ensure_db()
-        return sqlite3.connect(self.db_path)
+        self._lock = threading.Lock()
+        # Обслуживание БД — в фоновом потоке по расписанию
+        self._stop_event = threading.Event()
+        self._maintenance = threading.Thread(target=self._maintenance_loop, daemon=True)
+        self._maintenance.start()
+
+    def _maintenance_loop(self) -> None:
+        """Раз в DB_OPTIMIZE_INTERVAL_SECONDS обслуживает БД до остановки хранилища."""
+        while not self._stop_event.wait(DB_OPTIMIZE_INTERVAL_SECONDS):
+            self._maintain()
+
+    def _maintain(self) -> None:
+        """Обновляет статистику планировщика и возвращает свободные страницы."""
+        try:
+            with self._write_lock:
+                if self._closed:
+                    return
+                self._conn.execute("PRAGMA optimize")
+                # execute() делает у прагмы без результата ровно один шаг —
+                # освобождается одна страница; executescript() выполняет её
+                # до конца и возвращает все свободные страницы
+                self._conn.executescript("PRAGMA incremental_vacuum")
+        except sqlite3.Error:
+            logging.exception("Ошибка обслуживания БД")
+
+    def _execute(self, sql: str, params: tuple = ()) -> list[tuple]:
+        """Выполняет запись и возвращает строки RETURNING (если есть)."""
+        with self._write_lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Хранилище закрыто")
+            with self._conn:
+                # Строки RETURNING нужно дочитать до COMMIT
+                return self._conn.execute(sql, params).fetchall()
+
+    def close(self, timeout: float = 2.0) -> None:
+        """Останавливает обслуживание и закрывает соединения.
+
+        Вызывать после остановки всех потоков, которые пишут в БД.
+        """
+        self._stop_event.set()
+        self._maintenance.join(timeout=timeout)
+        with self._write_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._conn.close()
+        # Читающие соединения других потоков закрываются вместе с их потоками
+        ro = getattr(self._local, "ro", None)
+        if ro is not None:
+            ro.close()
+            self._local.ro = None
+
+    @contextmanager
+    def _read(self) -> Iterator[sqlite3.Connection]:
+        """Соединение только для чтения текущего потока (не блокируется записью в WAL)."""
+        if self._closed:
+            raise sqlite3.ProgrammingError("Хранилище закрыто")
+        ro = getattr(self._local, "ro", None)
+        if ro is None:
+            ro = sqlite3.connect(self._ro_uri, uri=True)
+            ro.row_factory = None
+            ro.text_factory = str
+            self._local.ro = ro
+        yield ro
+
+    @staticmethod
+    @contextmanager
+    def _transaction(conn: sqlite3.Connection) -> Iterator[None]:
+        """Явная транзакция для миграции: шаги с DDL применяются все или ни одного.
+
+        sqlite3 выполняет DDL вне транзакции (автокоммит), поэтому без явного
+        BEGIN прерванная пересборка таблицы оставляет БД в промежуточном виде.
+        """
+        conn.commit()
+        conn.execute("BEGIN")
+        try:
+            yield
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
 
     def _migrate_db(self) -> None:
         """Добавляет недостающие колонки (миграции)."""
@@ -55,6 +168,46 @@ class Storage:
                 """
             )
 
+            # pending_requests -> WITHOUT ROWID: поиск по токену — один проход
+            # по B-дереву первичного ключа вместо двух (token -> rowid -> строка)
+            row = conn.execute(
+                "SELECT sql FROM sqlite_master WHERE type='table' AND name='pending_requests'"
+            ).fetchone()
+            needs_rebuild = row is not None and "WITHOUT ROWID" not in row[0].upper()
+            # pending_requests_old может остаться от прерванной миграции
+            # прошлых версий — её токены переносим при следующем запуске
+            has_old = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='pending_requests_old'"
+            ).fetchone() is not None
+            if needs_rebuild or has_old:
+                with self._transaction(conn):
+                    if needs_rebuild:
+                        if has_old:
+                            conn.execute(
+                                "INSERT OR IGNORE INTO pending_requests_old "
+                                "SELECT token, url, title, description, channel_url FROM pending_requests"
+                            )
+                            conn.execute("DROP TABLE pending_requests")
+                        else:
+                            conn.execute("ALTER TABLE pending_requests RENAME TO pending_requests_old")
+                        conn.execute(
+                            """
+                            CREATE TABLE pending_requests (
+                                token TEXT PRIMARY KEY,
+                                url TEXT NOT NULL,
+                                title TEXT,
+                                description TEXT,
+                                channel_url TEXT
+                            ) WITHOUT ROWID
+                            """
+                        )
+                    conn.execute(
+                        "INSERT OR IGNORE INTO pending_requests "
+                        "SELECT token, url, title, description, channel_url FROM pending_requests_old "
+                        "WHERE token IS NOT NULL"
+                    )
+                    conn.execute("DROP TABLE pending_requests_old")
+
             # Расширение downloads для истории загрузок
             dl_cols = {row[1] for row in conn.execute("PRAGMA table_info(downloads)").fetchall()}
             if "url" not in dl_cols:
@@ -66,9 +219,69 @@ class Storage:
             if "audio_only" not in dl_cols:
                 conn.execute("ALTER TABLE downloads ADD COLUMN audio_only INTEGER DEFAULT 0")
 
+            # created_at (TEXT) -> created_at_ts (unix-секунды): фильтры по времени
+            # сравнивают целые числа и идут диапазоном по индексу, без разбора дат.
+            # ALTER TABLE не добавляет NOT NULL-колонку с вычисляемым DEFAULT,
+            # поэтому таблица пересоздаётся со схемой как в новой БД (в т.ч. если
+            # created_at_ts ранее добавили допускающей NULL)
+            ts_col = next(
+                (row for row in conn.execute("PRAGMA table_info(downloads)") if row[1] == "created_at_ts"),
+                None,
+            )
+            if ts_col is None or not ts_col[3] or "created_at" in dl_cols:
+                sources = []
+                if ts_col is not None:
+                    sources.append("created_at_ts")
+                if "created_at" in dl_cols:
+                    sources.append("CAST(strftime('%s', created_at) AS INTEGER)")
+                ts_expr = f"COALESCE({', '.join(sources)}, 0)"
+                with self._transaction(conn):
+                    # Пустая downloads_new могла остаться от прерванной миграции
+                    # прошлой версии (CREATE TABLE там фиксировался сразу)
+                    conn.execute("DROP TABLE IF EXISTS downloads_new")
+                    conn.execute(
+                        """
+                        CREATE TABLE downloads_new (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            user_id INTEGER NOT NULL,
+                            platform TEXT,
+                            status TEXT,
+                            created_at_ts INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+                            url TEXT DEFAULT '',
+                            title TEXT DEFAULT '',
+                            telegram_file_id TEXT DEFAULT '',
+                            audio_only INTEGER DEFAULT 0
+                        )
+                        """
+                    )
+                    conn.execute(
+                        "INSERT INTO downloads_new "
+                        "(id, user_id, platform, status, created_at_ts, url, title, telegram_file_id, audio_only) "
+                        f"SELECT id, user_id, platform, status, {ts_expr}, "
+                        "url, title, telegram_file_id, audio_only FROM downloads"
+                    )
+                    conn.execute("DROP TABLE downloads")
+                    conn.execute("ALTER TABLE downloads_new RENAME TO downloads")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_downloads_created ON downloads(created_at_ts)"
+            )
+
+            # Статистика sqlite_stat1 по всем индексам: без неё планировщик
+            # выбирает индекс эвристически
+            conn.execute("ANALYZE")
+
     def _init_db(self) -> None:
         """Создаёт все таблицы БД."""
+        is_new = not os.path.exists(self.db_path)
         with sqlite3.connect(self.db_path) as conn:
+            # auto_vacuum можно включить только в пустой БД: удалённые строки
+            # (запросы, отложенные загрузки) освобождают место через
+            # incremental_vacuum без полной перезаписи файла
+            if is_new:
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            # WAL: один писатель параллельно с любым числом читателей
+            # (режим сохраняется в файле БД)
+            conn.execute("PRAGMA journal_mode=WAL")
             conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS pending_requests (
@@ -77,7 +290,7 @@ class Storage:
                     title TEXT,
                     description TEXT,
                     channel_url TEXT
-                )
+                ) WITHOUT ROWID
                 """
             )
             conn.execute(
@@ -99,7 +312,7 @@ class Storage:
                     user_id INTEGER NOT NULL,
                     platform TEXT,
                     status TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    created_at_ts INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
                 )
                 """
             )
@@ -206,22 +419,33 @@ class Storage:
                 )
                 """
             )
+            # --- Индексы ---
+            # Проверка лимита бесплатных загрузок: диапазон по (user_id, created_at)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_free_downloads_user "
+                "ON free_downloads(user_id, created_at)"
+            )
+            # Частичный индекс только по открытым тикетам: list_open_tickets
+            # читает строки сразу в нужном порядке, без сортировки
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_open_tickets "
+                "ON support_tickets(created_at DESC) WHERE status = 'open'"
+            )
 
     # --- Ожидающие запросы ---
 
     def create_request(self, url: str, title: str, description: str, channel_url: str | None) -> str:
         """Создаёт запрос на скачивание и возвращает токен."""
         token = uuid.uuid4().hex[:12]
-        with self._connect() as conn:
-            conn.execute(
-                "INSERT INTO pending_requests (token, url, title, description, channel_url) VALUES (?, ?, ?, ?, ?)",
-                (token, url, title, description, channel_url),
-            )
+        self._execute(
+            "INSERT INTO pending_requests (token, url, title, description, channel_url) VALUES (?, ?, ?, ?, ?)",
+            (token, url, title, description, channel_url),
+        )
         return token
 
     def get_request(self, token: str) -> tuple[str, str, str, str | None] | None:
         """Возвращает данные запроса по токену."""
-        with self._connect() as conn:
+        with self._read() as conn:
             cur = conn.execute(
                 "SELECT url, title, description, channel_url FROM pending_requests WHERE token = ?",
                 (token,),
@@ -233,55 +457,53 @@ class Storage:
 
     def delete_request(self, token: str) -> None:
         """Удаляет запрос по токену."""
-        with self._connect() as conn:
-            conn.execute("DELETE FROM pending_requests WHERE token = ?", (token,))
+        self._execute("DELETE FROM pending_requests WHERE token = ?", (token,))
 
     # --- Пользователи ---
 
     def upsert_user(self, user_id: int, username: str, first_name: str, last_name: str) -> None:
         """Создаёт или обновляет данные пользователя."""
-        with self._connect() as conn:
-            conn.execute(
-                """
-                INSERT INTO users (user_id, username, first_name, last_name, blocked, last_inline_message_id)
-                VALUES (?, ?, ?, ?, 0, NULL)
-                ON CONFLICT(user_id)
-                DO UPDATE SET username = excluded.username,
-                              first_name = excluded.first_name,
-                              last_name = excluded.last_name
-                """,
-                (user_id, username, first_name, last_name),
-            )
+        self._execute(
+            """
+            INSERT INTO users (user_id, username, first_name, last_name, blocked, last_inline_message_id)
+            VALUES (?, ?, ?, ?, 0, NULL)
+            ON CONFLICT(user_id)
+            DO UPDATE SET username = excluded.username,
+                          first_name = excluded.first_name,
+                          last_name = excluded.last_name
+            """,
+            (user_id, username, first_name, last_name),
+        )
 
     def is_blocked(self, user_id: int) -> bool:
-        """Проверяет, заблокирован ли пользователь."""
-        with self._connect() as conn:
-            cur = conn.execute(
-                "SELECT blocked FROM users WHERE user_id = ?",
-                (user_id,),
-            )
-            row = cur.fetchone()
-        return bool(row and row[0])
+        """Проверяет, заблокирован ли пользователь (без обращения к БД)."""
+        return user_id in self._blocked
 
     def set_blocked(self, user_id: int, blocked: bool) -> None:
         """Устанавливает статус блокировки пользователя."""
-        with self._connect() as conn:
-            conn.execute(
-                "UPDATE users SET blocked = ? WHERE user_id = ?",
-                (1 if blocked else 0, user_id),
-            )
+        self._execute(
+            "UPDATE users SET blocked = ? WHERE user_id = ?",
+            (1 if blocked else 0, user_id),
+        )
+        with self._lock:
+            if blocked:
+                self._blocked.add(user_id)
+            else:
+                self._blocked.discard(user_id)
 
-    def list_users(self) -> list[tuple[int, str, str, str, int]]:
-        """Возвращает список всех пользователей."""
-        with self._connect() as conn:
+    def list_users(self, limit: int = -1, offset: int = 0) -> list[tuple[int, str, str, str, int]]:
+        """Возвращает список пользователей (по умолчанию всех, иначе страницу limit/offset)."""
+        with self._read() as conn:
             cur = conn.execute(
-                "SELECT user_id, username, first_name, last_name, blocked FROM users ORDER BY user_id"
+                "SELECT user_id, username, first_name, last_name, blocked FROM users "
+                "ORDER BY user_id LIMIT ? OFFSET ?",
+                (limit, offset),
             )
             return cur.fetchall()
 
     def get_user(self, user_id: int) -> tuple[int, str, str, str, int] | None:
         """Возвращает данные пользователя по ID."""
-        with self._connect() as conn:
+        with self._read() as conn:
             cur = conn.execute(
                 "SELECT user_id, username, first_name, last_name, blocked FROM users WHERE user_id = ?",
                 (user_id,),
@@ -290,12 +512,12 @@ class Storage:
 
     def count_users(self) -> int:
         """Возвращает общее количество пользователей."""
-        with self._connect() as conn:
+        with self._read() as conn:
             return conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
 
     def get_last_inline_message_id(self, user_id: int) -> int | None:
         """Возвращает ID последнего инлайн-сообщения пользователя."""
-        with self._connect() as conn:
+        with self._read() as conn:
             cur = conn.execute(
                 "SELECT last_inline_message_id FROM users WHERE user_id = ?",
                 (user_id,),
@@ -307,15 +529,14 @@ class Storage:
 
     def set_last_inline_message_id(self, user_id: int, message_id: int | None) -> None:
         """Сохраняет ID последнего инлайн-сообщения пользователя."""
-        with self._connect() as conn:
-            conn.execute(
-                "UPDATE users SET last_inline_message_id = ? WHERE user_id = ?",
-                (message_id, user_id),
-            )
+        self._execute(
+            "UPDATE users SET last_inline_message_id = ? WHERE user_id = ?",
+            (message_id, user_id),
+        )
 
     def get_user_device_type(self, user_id: int) -> str | None:
         """Возвращает тип устройства пользователя ('android', 'iphone' или None)."""
-        with self._connect() as conn:
+        with self._read() as conn:
             cur = conn.execute(
                 "SELECT device_type FROM users WHERE user_id = ?",
                 (user_id,),
@@ -325,11 +546,10 @@ class Storage:
 
     def set_user_device_type(self, user_id: int, device_type: str) -> None:
         """Устанавливает тип устройства пользователя."""
-        with self._connect() as conn:
-            conn.execute(
-                "UPDATE users SET device_type = ? WHERE user_id = ?",
-                (device_type, user_id),
-            )
+        self._execute(
+            "UPDATE users SET device_type = ? WHERE user_id = ?",
+            (device_type, user_id),
+        )
 
     # --- Загрузки ---
 
@@ -344,27 +564,32 @@ class Storage:
         audio_only: bool = False,
     ) -> None:
         """Записывает событие загрузки."""
-        with self._connect() as conn:
-            conn.execute(
-                "INSERT INTO downloads (user_id, platform, status, url, title, telegram_file_id, audio_only) "
-                "VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (user_id, platform, status, url, title, telegram_file_id, audio_only),
-            )
+        self._execute(
+            "INSERT INTO downloads "
+            "(user_id, platform, status, url, title, telegram_file_id, audio_only, created_at_ts) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (user_id, platform, status, url, title, telegram_file_id, audio_only, int(time.time())),
+        )
 
     def log_free_download(self, user_id: int, created_at: int) -> None:
         """Записывает бесплатную загрузку для учёта лимитов."""
-        with self._connect() as conn:
-            conn.execute(
-                "INSERT INTO free_downloads (user_id, created_at) VALUES (?, ?)",
-                (user_id, created_at),
-            )
+        self._execute(
+            "INSERT INTO free_downloads (user_id, created_at) VALUES (?, ?)",
+            (user_id, created_at),
+        )
+
+    def free_downloads_at_least(self, user_id: int, start_ts: int, limit: int) -> int:
+        """Считает бесплатные загрузки с указанного момента, но не больше limit.
 
-    def count_free_downloads_since(self, user_id: int, start_ts: int) -> int:
-        """Считает бесплатные загрузки пользователя с указанного момента."""
-        with self._connect() as conn:
+        Для проверки «лимит исчерпан?» точное число не нужно: просмотр
+        индекса останавливается на limit-й строке.
+        """
+        with self._read() as conn:
             cur = conn.execute(
-                "SELECT COUNT(*) FROM free_downloads WHERE user_id = ? AND created_at >= ?",
-                (user_id, start_ts),
+                "SELECT COUNT(*) FROM ("
+                "  SELECT 1 FROM free_downloads WHERE user_id = ? AND created_at >= ? LIMIT ?"
+                ")",
+                (user_id, start_ts, limit),
             )
             row = cur.fetchone()
         return int(row[0]) if row else 0
@@ -373,14 +598,15 @@ class Storage:
 
     def get_usage_stats(self) -> tuple[int, int]:
         """Возвращает общую статистику: (кол-во пользователей, кол-во загрузок)."""
-        with self._connect() as conn:
-            total_users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
-            total_downloads = conn.execute("SELECT COUNT(*) FROM downloads").fetchone()[0]
+        with self._read() as conn:
+            total_users, total_downloads = conn.execute(
+                "SELECT (SELECT COUNT(*) FROM users), (SELECT COUNT(*) FROM downloads)"
+            ).fetchone()
         return int(total_users), int(total_downloads)
 
     def get_user_stats(self) -> list[tuple[int, int]]:
         """Возвращает статистику загрузок по пользователям."""
-        with self._connect() as conn:
+        with self._read() as conn:
             cur = conn.execute(
                 "SELECT user_id, COUNT(*) FROM downloads GROUP BY user_id ORDER BY COUNT(*) DESC"
             )
@@ -388,7 +614,7 @@ class Storage:
 
     def get_user_download_count(self, user_id: int) -> int:
         """Возвращает количество загрузок пользователя."""
-        with self._connect() as conn:
+        with self._read() as conn:
             cur = conn.execute(
                 "SELECT COUNT(*) FROM downloads WHERE user_id = ?",
                 (user_id,),
@@ -397,7 +623,7 @@ class Storage:
 
     def get_stats_by_platform(self) -> list[tuple[str, int]]:
         """Возвращает статистику загрузок по платформам."""
-        with self._connect() as conn:
+        with self._read() as conn:
             cur = conn.execute(
                 "SELECT COALESCE(platform, 'unknown'), COUNT(*) FROM downloads "
                 "GROUP BY platform ORDER BY COUNT(*) DESC"
@@ -406,10 +632,10 @@ class Storage:
 
     def get_stats_by_day(self, days: int = 7) -> list[tuple[str, int]]:
         """Возвращает статистику загрузок по дням за последние N дней."""
-        with self._connect() as conn:
+        with self._read() as conn:
             cur = conn.execute(
-                "SELECT DATE(created_at) as day, COUNT(*) FROM downloads "
-                "WHERE created_at >= datetime('now', ? || ' days') "
+                "SELECT DATE(created_at_ts, 'unixepoch') as day, COUNT(*) FROM downloads "
+                "WHERE created_at_ts >= CAST(strftime('%s', 'now', ? || ' days') AS INTEGER) "
                 "GROUP BY day ORDER BY day DESC",
                 (f"-{days}",),
             )
@@ -417,17 +643,19 @@ class Storage:
 
     def get_downloads_today(self) -> int:
         """Возвращает количество загрузок за сегодня."""
-        with self._connect() as conn:
+        with self._read() as conn:
             cur = conn.execute(
-                "SELECT COUNT(*) FROM downloads WHERE DATE(created_at) = DATE('now')"
+                "SELECT COUNT(*) FROM downloads "
+                "WHERE created_at_ts >= CAST(strftime('%s', 'now', 'start of day') AS INTEGER)"
             )
             return cur.fetchone()[0]
 
     def get_downloads_week(self) -> int:
         """Возвращает количество загрузок за последние 7 дней."""
-        with self._connect() as conn:
+        with self._read() as conn:
             cur = conn.execute(
-                "SELECT COUNT(*) FROM downloads WHERE created_at >= datetime('now', '-7 days')"
+                "SELECT COUNT(*) FROM downloads "
+                "WHERE created_at_ts >= CAST(strftime('%s', 'now', '-7 days') AS INTEGER)"
             )
             return cur.fetchone()[0]
 
@@ -445,7 +673,8 @@ class Storage:
         Фильтрация по user_id и/или platform. Отдаёт только успешные.
         """
         query = (
-            "SELECT id, user_id, platform, status, created_at, url, title, telegram_file_id, audio_only "
+            "SELECT id, user_id, platform, status, datetime(created_at_ts, 'unixepoch'), "
+            "url, title, telegram_file_id, audio_only "
             "FROM downloads WHERE status = 'success'"
         )
         params: list = []
@@ -455,9 +684,9 @@ class Storage:
         if platform:
             query += " AND platform = ?"
             params.append(platform)
-        query += " ORDER BY created_at DESC LIMIT ? OFFSET ?"
+        query += " ORDER BY created_at_ts DESC LIMIT ? OFFSET ?"
         params.extend([per_page, page * per_page])
-        with self._connect() as conn:
+        with self._read() as conn:
             return conn.execute(query, params).fetchall()
 
     def count_download_history(
@@ -474,7 +703,7 @@ class Storage:
         if platform:
             query += " AND platform = ?"
             params.append(platform)
-        with self._connect() as conn:
+        with self._read() as conn:
             return conn.execute(query, params).fetchone()[0]
 
     def get_download_platforms(self, user_id: int | None = None) -> list[tuple[str, int]]:
@@ -488,14 +717,15 @@ class Storage:
             query += " AND user_id = ?"
             params.append(user_id)
         query += " GROUP BY platform ORDER BY COUNT(*) DESC"
-        with self._connect() as conn:
+        with self._read() as conn:
             return conn.execute(query, params).fetchall()
 
     def get_download_by_id(self, download_id: int) -> tuple | None:
         """Возвращает загрузку по ID: (id, user_id, platform, status, created_at, url, title, telegram_file_id, audio_only)."""
-        with self._connect() as conn:
+        with self._read() as conn:
             cur = conn.execute(
-                "SELECT id, user_id, platform, status, created_at, url, title, telegram_file_id, audio_only "
+                "SELECT id, user_id, platform, status, datetime(created_at_ts, 'unixepoch'), "
+                "url, title, telegram_file_id, audio_only "
                 "FROM downloads WHERE id = ?",
                 (download_id,),
             )
@@ -508,7 +738,7 @@ class Storage:
     ) -> list[tuple[str, int]]:
         """Возвращает даты загрузок с количествами: [(date_str, count), ...]."""
         query = (
-            "SELECT DATE(created_at) as day, COUNT(*) FROM downloads "
+            "SELECT DATE(created_at_ts, 'unixepoch') as day, COUNT(*) FROM downloads "
             "WHERE status = 'success'"
         )
         params: list = []
@@ -519,20 +749,19 @@ class Storage:
             query += " AND platform = ?"
             params.append(platform)
         query += " GROUP BY day ORDER BY day DESC"
-        with self._connect() as conn:
+        with self._read() as conn:
             return conn.execute(query, params).fetchall()
 
     def update_download_file_id(self, download_id: int, telegram_file_id: str) -> None:
         """Обновляет telegram_file_id для записи загрузки (для отложенного кэширования)."""
-        with self._connect() as conn:
-            conn.execute(
-                "UPDATE downloads SET telegram_file_id = ? WHERE id = ?",
-                (telegram_file_id, download_id),
-            )
+        self._execute(
+            "UPDATE downloads SET telegram_file_id = ? WHERE id = ?",
+            (telegram_file_id, download_id),
+        )
 
     def get_users_with_downloads(self, page: int = 0, per_page: int = 10) -> list[tuple[int, str, str, int]]:
         """Возвращает пользователей с загрузками: [(user_id, username, first_name, download_count), ...]."""
-        with self._connect() as conn:
+        with self._read() as conn:
             cur = conn.execute(
                 "SELECT u.user_id, u.username, u.first_name, COUNT(d.id) as cnt "
                 "FROM users u JOIN downloads d ON u.user_id = d.user_id "
@@ -546,7 +775,7 @@ class Storage:
 
     def count_users_with_downloads(self) -> int:
         """Считает пользователей, у которых есть успешные загрузки."""
-        with self._connect() as conn:
+        with self._read() as conn:
             return conn.execute(
                 "SELECT COUNT(DISTINCT user_id) FROM downloads WHERE status = 'success'"
             ).fetchone()[0]
@@ -555,16 +784,15 @@ class Storage:
 
     def create_ticket(self, user_id: int) -> int:
         """Создаёт тикет поддержки и возвращает его ID."""
-        with self._connect() as conn:
-            cur = conn.execute(
-                "INSERT INTO support_tickets (user_id) VALUES (?)",
-                (user_id,),
-            )
-            return cur.lastrowid
+        rows = self._execute(
+            "INSERT INTO support_tickets (user_id) VALUES (?) RETURNING id",
+            (user_id,),
+        )
+        return rows[0][0]
 
     def get_ticket(self, ticket_id: int) -> tuple[int, int, str, str] | None:
         """Возвращает данные тикета по ID."""
-        with self._connect() as conn:
+        with self._read() as conn:
             cur = conn.execute(
                 "SELECT id, user_id, status, created_at FROM support_tickets WHERE id = ?",
                 (ticket_id,),
@@ -573,7 +801,7 @@ class Storage:
 
     def list_open_tickets(self) -> list[tuple[int, int, str, str]]:
         """Возвращает список открытых тикетов."""
-        with self._connect() as conn:
+        with self._read() as conn:
             cur = conn.execute(
                 "SELECT t.id, t.user_id, t.status, t.created_at "
                 "FROM support_tickets t WHERE t.status = 'open' "
@@ -583,11 +811,10 @@ class Storage:
 
     def close_ticket(self, ticket_id: int) -> None:
         """Закрывает тикет."""
-        with self._connect() as conn:
-            conn.execute(
-                "UPDATE support_tickets SET status = 'closed' WHERE id = ?",
-                (ticket_id,),
-            )
+        self._execute(
+            "UPDATE support_tickets SET status = 'closed' WHERE id = ?",
+            (ticket_id,),
+        )
 
     def add_ticket_message(
         self,
@@ -599,16 +826,15 @@ class Storage:
         file_type: str | None = None,
     ) -> None:
         """Добавляет сообщение к тикету."""
-        with self._connect() as conn:
-            conn.execute(
-                "INSERT INTO support_messages (ticket_id, from_user_id, is_admin, text, file_id, file_type) "
-                "VALUES (?, ?, ?, ?, ?, ?)",
-                (ticket_id, from_user_id, 1 if is_admin else 0, text, file_id, file_type),
-            )
+        self._execute(
+            "INSERT INTO support_messages (ticket_id, from_user_id, is_admin, text, file_id, file_type) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (ticket_id, from_user_id, 1 if is_admin else 0, text, file_id, file_type),
+        )
 
     def get_ticket_messages(self, ticket_id: int) -> list[tuple[int, int, int, str | None, str | None, str | None, str]]:
         """Возвращает все сообщения тикета."""
-        with self._connect() as conn:
+        with self._read() as conn:
             cur = conn.execute(
                 "SELECT id, from_user_id, is_admin, text, file_id, file_type, created_at "
                 "FROM support_messages WHERE ticket_id = ? ORDER BY created_at ASC",
@@ -618,7 +844,7 @@ class Storage:
 
     def count_open_tickets(self) -> int:
         """Возвращает количество открытых тикетов."""
-        with self._connect() as conn:
+        with self._read() as conn:
             return conn.execute(
                 "SELECT COUNT(*) FROM support_tickets WHERE status = 'open'"
             ).fetchone()[0]
@@ -626,58 +852,61 @@ class Storage:
     # --- Обязательные каналы ---
 
     def get_required_channels(self) -> list[tuple[int, str | None, str | None]]:
-        """Возвращает список обязательных каналов."""
-        with self._connect() as conn:
-            cur = conn.execute(
-                "SELECT chat_id, title, invite_link FROM required_channels"
-            )
-            return cur.fetchall()
+        """Возвращает список обязательных каналов (из снимка в памяти).
+
+        Порядок — по chat_id, как у выборки из таблицы (chat_id — её rowid),
+        чтобы кнопки подписки не переставлялись после перезапуска.
+        """
+        with self._lock:
+            return sorted(self._required_channels.values())
 
     def add_required_channel(self, chat_id: int, title: str | None = None, invite_link: str | None = None) -> None:
         """Добавляет или обновляет обязательный канал."""
-        with self._connect() as conn:
-            conn.execute(
-                """
-                INSERT INTO required_channels (chat_id, title, invite_link)
-                VALUES (?, ?, ?)
-                ON CONFLICT(chat_id) DO UPDATE SET
-                    title = COALESCE(excluded.title, required_channels.title),
-                    invite_link = COALESCE(excluded.invite_link, required_channels.invite_link)
-                """,
-                (chat_id, title, invite_link),
-            )
+        self._execute(
+            """
+            INSERT INTO required_channels (chat_id, title, invite_link)
+            VALUES (?, ?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET
+                title = COALESCE(excluded.title, required_channels.title),
+                invite_link = COALESCE(excluded.invite_link, required_channels.invite_link)
+            """,
+            (chat_id, title, invite_link),
+        )
+        with self._lock:
+            old = self._required_channels.get(chat_id)
+            if old is not None:
+                title = title if title is not None else old[1]
+                invite_link = invite_link if invite_link is not None else old[2]
+            self._required_channels[chat_id] = (chat_id, title, invite_link)
 
     def remove_required_channel(self, chat_id: int) -> None:
         """Удаляет обязательный канал."""
-        with self._connect() as conn:
-            conn.execute(
-                "DELETE FROM required_channels WHERE chat_id = ?",
-                (chat_id,),
-            )
+        self._execute(
+            "DELETE FROM required_channels WHERE chat_id = ?",
+            (chat_id,),
+        )
+        with self._lock:
+            self._required_channels.pop(chat_id, None)
 
     # --- Настройки бота ---
 
     def get_setting(self, key: str, default: str | None = None) -> str | None:
-        """Возвращает значение настройки по ключу."""
-        with self._connect() as conn:
-            cur = conn.execute(
-                "SELECT value FROM bot_settings WHERE key = ?",
-                (key,),
-            )
-            row = cur.fetchone()
-        return row[0] if row else default
+        """Возвращает значение настройки по ключу (из снимка в памяти)."""
+        value = self._settings.get(key)
+        return value if value is not None else default
 
     def set_setting(self, key: str, value: str) -> None:
         """Устанавливает значение настройки."""
-        with self._connect() as conn:
-            conn.execute(
-                """
-                INSERT INTO bot_settings (key, value)
-                VALUES (?, ?)
-                ON CONFLICT(key) DO UPDATE SET value = excluded.value
-                """,
-                (key, value),
-            )
+        self._execute(
+            """
+            INSERT INTO bot_settings (key, value)
+            VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+            """,
+            (key, value),
+        )
+        with self._lock:
+            self._settings[key] = value
 
     # --- Инциденты воспроизведения видео ---
 
@@ -692,17 +921,16 @@ class Storage:
         file_size: int | None = None,
     ) -> int:
         """Создаёт инцидент воспроизведения видео и возвращает его ID."""
-        with self._connect() as conn:
-            cur = conn.execute(
-                "INSERT INTO video_incidents (user_id, url, platform, format_id, codec, resolution, file_size) "
-                "VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (user_id, url, platform, format_id, codec, resolution, file_size),
-            )
-            return cur.lastrowid
+        rows = self._execute(
+            "INSERT INTO video_incidents (user_id, url, platform, format_id, codec, resolution, file_size) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) RETURNING id",
+            (user_id, url, platform, format_id, codec, resolution, file_size),
+        )
+        return rows[0][0]
 
     def get_video_incident(self, incident_id: int) -> tuple | None:
         """Возвращает данные инцидента: (id, user_id, url, platform, format_id, codec, resolution, file_size, status, created_at, resolved_at)."""
-        with self._connect() as conn:
+        with self._read() as conn:
             cur = conn.execute(
                 "SELECT id, user_id, url, platform, format_id, codec, resolution, file_size, status, created_at, resolved_at "
                 "FROM video_incidents WHERE id = ?",
@@ -712,7 +940,7 @@ class Storage:
 
     def list_video_incidents(self, status: str | None = None) -> list[tuple]:
         """Возвращает список инцидентов (опционально фильтр по статусу)."""
-        with self._connect() as conn:
+        with self._read() as conn:
             if status:
                 cur = conn.execute(
                     "SELECT id, user_id, url, platform, format_id, codec, resolution, file_size, status, created_at, resolved_at "
@@ -728,21 +956,20 @@ class Storage:
 
     def set_incident_status(self, incident_id: int, status: str) -> None:
         """Обновляет статус инцидента. При 'fixed'/'wont_fix' устанавливает resolved_at."""
-        with self._connect() as conn:
-            if status in ("fixed", "wont_fix"):
-                conn.execute(
-                    "UPDATE video_incidents SET status = ?, resolved_at = CURRENT_TIMESTAMP WHERE id = ?",
-                    (status, incident_id),
-                )
-            else:
-                conn.execute(
-                    "UPDATE video_incidents SET status = ? WHERE id = ?",
-                    (status, incident_id),
-                )
+        if status in ("fixed", "wont_fix"):
+            self._execute(
+                "UPDATE video_incidents SET status = ?, resolved_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (status, incident_id),
+            )
+        else:
+            self._execute(
+                "UPDATE video_incidents SET status = ? WHERE id = ?",
+                (status, incident_id),
+            )
 
     def list_all_user_ids(self) -> list[int]:
         """Возвращает список ID всех незаблокированных пользователей."""
-        with self._connect() as conn:
+        with self._read() as conn:
             cur = conn.execute(
                 "SELECT user_id FROM users WHERE blocked = 0"
             )
@@ -750,7 +977,7 @@ class Storage:
 
     def list_affected_user_ids(self) -> list[int]:
         """Возвращает список ID пользователей с открытыми тикетами или инцидентами."""
-        with self._connect() as conn:
+        with self._read() as conn:
             cur = conn.execute(
                 "SELECT DISTINCT user_id FROM ("
                 "  SELECT user_id FROM support_tickets WHERE status = 'open'"
@@ -762,7 +989,7 @@ class Storage:
 
     def count_open_incidents(self) -> int:
         """Возвращает количество открытых инцидентов (reported + in_progress)."""
-        with self._connect() as conn:
+        with self._read() as conn:
             return conn.execute(
                 "SELECT COUNT(*) FROM video_incidents WHERE status IN ('reported', 'in_progress')"
             ).fetchone()[0]
@@ -783,20 +1010,19 @@ class Storage:
     ) -> None:
         """Сохраняет file_id от Telegram для повторной отправки."""
         fmt = format_id or "best"
-        with self._connect() as conn:
-            conn.execute(
-                """
-                INSERT INTO file_cache
-                    (url, format_id, reencoded, audio_only, telegram_file_id, codec, resolution, file_size, platform)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ON CONFLICT(url, format_id, reencoded, audio_only)
-                DO UPDATE SET telegram_file_id = excluded.telegram_file_id,
-                              file_size = excluded.file_size,
-                              created_at = CURRENT_TIMESTAMP
-                """,
-                (url, fmt, 1 if reencoded else 0, 1 if audio_only else 0,
-                 telegram_file_id, codec, resolution, file_size, platform),
-            )
+        self._execute(
+            """
+            INSERT INTO file_cache
+                (url, format_id, reencoded, audio_only, telegram_file_id, codec, resolution, file_size, platform)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(url, format_id, reencoded, audio_only)
+            DO UPDATE SET telegram_file_id = excluded.telegram_file_id,
+                          file_size = excluded.file_size,
+                          created_at = CURRENT_TIMESTAMP
+            """,
+            (url, fmt, 1 if reencoded else 0, 1 if audio_only else 0,
+             telegram_file_id, codec, resolution, file_size, platform),
+        )
 
     def get_cached_file(
         self,
@@ -807,7 +1033,7 @@ class Storage:
     ) -> str | None:
         """Возвращает telegram_file_id из кэша или None."""
         fmt = format_id or "best"
-        with self._connect() as conn:
+        with self._read() as conn:
             cur = conn.execute(
                 "SELECT telegram_file_id FROM file_cache "
                 "WHERE url = ? AND format_id = ? AND reencoded = ? AND audio_only = ?",
@@ -818,7 +1044,7 @@ class Storage:
 
     def get_cached_formats(self, url: str) -> list[tuple[str, int, int]]:
         """Возвращает список кэшированных форматов: [(format_id, reencoded, audio_only), ...]."""
-        with self._connect() as conn:
+        with self._read() as conn:
             cur = conn.execute(
                 "SELECT format_id, reencoded, audio_only FROM file_cache WHERE url = ?",
                 (url,),
@@ -827,7 +1053,7 @@ class Storage:
 
     def get_file_cache_stats(self) -> tuple[int, int]:
         """Возвращает (количество записей в кэше, экономия загрузок)."""
-        with self._connect() as conn:
+        with self._read() as conn:
             count = conn.execute("SELECT COUNT(*) FROM file_cache").fetchone()[0]
         return count, 0
 
@@ -837,44 +1063,40 @@ class Storage:
         self, user_id: int, chat_id: int, url: str, platform: str = "YouTube",
     ) -> int:
         """Добавляет отложенную загрузку. Возвращает ID записи."""
-        with self._connect() as conn:
-            cur = conn.execute(
-                "INSERT INTO pending_cookie_downloads (user_id, chat_id, url, platform) "
-                "VALUES (?, ?, ?, ?)",
-                (user_id, chat_id, url, platform),
-            )
-            return cur.lastrowid
+        rows = self._execute(
+            "INSERT INTO pending_cookie_downloads (user_id, chat_id, url, platform) "
+            "VALUES (?, ?, ?, ?) RETURNING id",
+            (user_id, chat_id, url, platform),
+        )
+        return rows[0][0]
 
     def list_pending_cookie_downloads(
         self, platform: str | None = None,
-    ) -> list[tuple[int, int, int, str, str, str]]:
-        """Возвращает отложенные загрузки: [(id, user_id, chat_id, url, platform, created_at), ...]."""
-        with self._connect() as conn:
-            if platform:
-                cur = conn.execute(
-                    "SELECT id, user_id, chat_id, url, platform, created_at "
-                    "FROM pending_cookie_downloads WHERE platform = ? "
-                    "ORDER BY created_at ASC",
-                    (platform,),
-                )
-            else:
-                cur = conn.execute(
-                    "SELECT id, user_id, chat_id, url, platform, created_at "
-                    "FROM pending_cookie_downloads ORDER BY created_at ASC"
-                )
-            return cur.fetchall()
+    ) -> list[tuple[int, int, int, str, str, str, int]]:
+        """Возвращает отложенные загрузки: [(id, user_id, chat_id, url, platform, created_at, blocked), ...]."""
+        query = (
+            "SELECT p.id, p.user_id, p.chat_id, p.url, p.platform, p.created_at, "
+            "COALESCE(u.blocked, 0) "
+            "FROM pending_cookie_downloads p LEFT JOIN users u ON u.user_id = p.user_id"
+        )
+        params: tuple = ()
+        if platform:
+            query += " WHERE p.platform = ?"
+            params = (platform,)
+        query += " ORDER BY p.created_at ASC"
+        with self._read() as conn:
+            return conn.execute(query, params).fetchall()
 
     def delete_pending_cookie_download(self, download_id: int) -> None:
         """Удаляет отложенную загрузку по ID."""
-        with self._connect() as conn:
-            conn.execute(
-                "DELETE FROM pending_cookie_downloads WHERE id = ?",
-                (download_id,),
-            )
+        self._execute(
+            "DELETE FROM pending_cookie_downloads WHERE id = ?",
+            (download_id,),
+        )
 
     def count_pending_cookie_downloads(self, platform: str | None = None) -> int:
         """Считает отложенные загрузки."""
-        with self._connect() as conn:
+        with self._read() as conn:
             if platform:
                 return conn.execute(
                     "SELECT COUNT(*) FROM pending_cookie_downloads WHERE platform = ?",
@@ -1,21 +1,40 @@
 """Общие утилиты: форматирование, URL-помощники, кэширование, повторные попытки."""
 
+import functools
+import hashlib
 import html
 import logging
+import math
 import os
+import random
+import re
 import time
 import traceback
 import threading
+from collections import OrderedDict
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from telebot.apihelper import ApiHTTPException, ApiTelegramException
 
 from app.constants import (
     BOT_SIGNATURE,
     CHANNEL_LINK,
     EMOJI_ALERT,
+    MEMBERSHIP_CACHE_MAX_SIZE,
+    MEMBERSHIP_CACHE_SWEEP_MIN_INTERVAL,
     MEMBERSHIP_CACHE_TTL,
     TELEGRAM_CAPTION_MAX_LENGTH,
     TELEGRAM_MAX_FILE_SIZE,
     UPLOAD_MAX_RETRIES,
-    UPLOAD_RETRY_DELAYS,
+    UPLOAD_READ_BUFFER_SIZE,
+    UPLOAD_RETRY_AFTER_MAX,
+    UPLOAD_RETRY_BASE_DELAY,
+    UPLOAD_RETRY_JITTER,
+    UPLOAD_RETRY_MAX_DELAY,
 )
 from app.config import (
     ADMIN_IDS,
@@ -27,14 +46,30 @@ from app.config import (
 # --- URL-помощники ---
 
 
+# Домены платформ: сверяется только хост URL (сам или без первой метки —
+# www., m., music.), упоминание домена в пути или query не считается
+_YOUTUBE_HOSTS = frozenset({"youtube.com", "youtu.be"})
+_INSTAGRAM_HOSTS = frozenset({"instagram.com", "instagr.am"})
+
+
+def _url_host_in(url: str, domains: frozenset[str]) -> bool:
+    """Проверяет, что хост URL — один из доменов или его поддомен (www., m., music. …)."""
+    try:
+        host = urlsplit(url).hostname
+    except ValueError:
+        return False
+    if not host:
+        return False
+    # hostname уже в нижнем регистре; сравниваем сам хост и домен без первой метки
+    return host in domains or host.partition(".")[2] in domains
+
+
 def is_youtube_url(url: str) -> bool:
-    lowered = url.lower()
-    return "youtube.com" in lowered or "youtu.be" in lowered
+    return _url_host_in(url, _YOUTUBE_HOSTS)
 
 
 def is_instagram_url(url: str) -> bool:
-    lowered = url.lower()
-    return "instagram.com" in lowered or "instagr.am" in lowered
+    return _url_host_in(url, _INSTAGRAM_HOSTS)
 
 
 def append_youtube_client_hint(message: str) -> str:
@@ -50,46 +85,63 @@ def append_youtube_client_hint(message: str) -> str:
 # --- Форматирование текста ---
 
 
+# Неизменная часть подписи: вычисляется один раз при импорте
+_SIGNATURE_SUFFIX = f"\n\n{BOT_SIGNATURE}"
+
+
+@functools.lru_cache(maxsize=256)
+def _tag_line(video_tag: str) -> str:
+    """Строка с тегом видео; тегов немного, экранируются один раз."""
+    return f"\n{html.escape(video_tag)}" if video_tag else ""
+
+
 def format_caption(title: str, video_tag: str = "", source_url: str = "") -> str:
     """Формирует подпись к медиафайлу с заголовком и подписью бота (HTML)."""
-    title = html.escape(title.strip())
-    tag_line = f"\n{html.escape(video_tag)}" if video_tag else ""
+    # Экранирование только удлиняет строку, поэтому хвост длиннее лимита
+    # заведомо не попадёт в подпись — экранируем лишь помещающийся префикс
+    title = html.escape(title.strip()[:TELEGRAM_CAPTION_MAX_LENGTH])
+    tag_line = _tag_line(video_tag)
+    if not title:
+        return (BOT_SIGNATURE + tag_line)[:TELEGRAM_CAPTION_MAX_LENGTH]
     source_line = ""
     if source_url:
         safe_url = html.escape(source_url, quote=True)
         source_line = f'\n\U0001f517 <a href="{safe_url}">Ссылка на исходник</a>'
-    if title:
-        caption = f"{title}{source_line}\n\n{BOT_SIGNATURE}{tag_line}"
-    else:
-        caption = f"{BOT_SIGNATURE}{tag_line}"
-    if len(caption) <= TELEGRAM_CAPTION_MAX_LENGTH:
-        return caption
+    tail = _SIGNATURE_SUFFIX + tag_line
+    suffix = source_line + tail
+    # Длину проверяем до склейки: длинная подпись собирается один раз
+    allowed_title = TELEGRAM_CAPTION_MAX_LENGTH - len(suffix)
+    if len(title) <= allowed_title:
+        return title + suffix
     # Сначала пробуем обрезать заголовок, сохраняя ссылку на исходник
-    suffix = f"{source_line}\n\n{BOT_SIGNATURE}{tag_line}"
-    allowed_title = max(0, TELEGRAM_CAPTION_MAX_LENGTH - len(suffix))
-    trimmed_title = title[:allowed_title].rstrip()
+    trimmed_title = title[:allowed_title].rstrip() if allowed_title > 0 else ""
     if trimmed_title:
-        return f"{trimmed_title}{suffix}"
+        return trimmed_title + suffix
     # Если не помещается даже с обрезанным заголовком — без ссылки
-    fallback_suffix = f"\n\n{BOT_SIGNATURE}{tag_line}"
-    allowed_title = max(0, TELEGRAM_CAPTION_MAX_LENGTH - len(fallback_suffix))
-    trimmed_title = title[:allowed_title].rstrip()
+    allowed_title = TELEGRAM_CAPTION_MAX_LENGTH - len(tail)
+    trimmed_title = title[:allowed_title].rstrip() if allowed_title > 0 else ""
     if trimmed_title:
-        return f"{trimmed_title}{fallback_suffix}"
+        return trimmed_title + tail
     return (BOT_SIGNATURE + tag_line)[:TELEGRAM_CAPTION_MAX_LENGTH]
 
 
+_SIZE_UNITS = ("B", "KB", "MB", "GB", "TB")
+_MAX_SIZE_UNIT = len(_SIZE_UNITS) - 1
+
+
 def format_bytes(value: float | None) -> str:
     """Форматирует размер в байтах в человекочитаемый вид."""
     if value is None:
         return "0 B"
-    units = ["B", "KB", "MB", "GB", "TB"]
     size = float(value)
-    for unit in units:
-        if size < 1024 or unit == units[-1]:
-            return f"{size:.1f} {unit}"
-        size /= 1024
-    return f"{size:.1f} {units[-1]}"
+    if not math.isfinite(size):
+        # inf/nan (бывают в прогрессе yt-dlp) — как в прежнем цикле делений:
+        # в последней единице, -inf — в байтах
+        idx = 0 if size < 0 else _MAX_SIZE_UNIT
+    else:
+        # Единица сразу по порядку величины: каждые 10 бит — следующая единица
+        idx = min((int(size).bit_length() - 1) // 10, _MAX_SIZE_UNIT) if size >= 1024 else 0
+    return f"{size / (1 << (10 * idx)):.1f} {_SIZE_UNITS[idx]}"
 
 
 def format_speed(value: float | None) -> str:
@@ -103,6 +155,12 @@ def format_limit_message(free_limit: int | None = None, window_seconds: int | No
     """Формирует сообщение о лимите бесплатных загрузок."""
     limit = free_limit if free_limit is not None else FREE_DOWNLOAD_LIMIT
     window = window_seconds if window_seconds is not None else FREE_DOWNLOAD_WINDOW_SECONDS
+    return _format_limit_message_cached(limit, window)
+
+
+@functools.lru_cache(maxsize=32)
+def _format_limit_message_cached(limit: int, window: int) -> str:
+    """Собирает текст сообщения о лимите; результат кэшируется по паре (limit, window)."""
     if window % 3600 == 0:
         hours = window // 3600
         period = f"{hours} \u0447\u0430\u0441(\u0430)" if hours != 1 else "1 \u0447\u0430\u0441"
@@ -122,33 +180,106 @@ def format_limit_message(free_limit: int | None = None, window_seconds: int | No
 # --- Проверка доступа ---
 
 
+# ADMIN_IDS в конфиге — список (порядок нужен для рассылок), для проверки
+# на каждом сообщении держим неизменяемое множество
+_ADMIN_ID_SET: frozenset[int] = frozenset(ADMIN_IDS)
+
+
 def is_admin(user_id: int) -> bool:
     """Проверяет, является ли пользователь администратором."""
-    return user_id in ADMIN_IDS
+    return user_id in _ADMIN_ID_SET
 
 
 # --- Работа с файлами ---
 
 
-def validate_file_size(file_path: str) -> bool:
-    """Проверяет, что размер файла в пределах лимита Telegram (50 МБ)."""
+def stat_file(file_path: str) -> os.stat_result | None:
+    """Один вызов stat(2) для файла; None, если файла нет или он недоступен."""
     try:
-        return os.path.getsize(file_path) <= TELEGRAM_MAX_FILE_SIZE
+        return os.stat(file_path)
     except OSError:
-        return False
+        return None
+
+
+def validate_file_size(file_path: str) -> bool:
+    """Проверяет, что размер файла в пределах лимита Telegram (50 МБ)."""
+    st = stat_file(file_path)
+    return st is not None and st.st_size <= TELEGRAM_MAX_FILE_SIZE
 
 
 def get_file_size(file_path: str) -> int | None:
     """Возвращает размер файла в байтах или None при ошибке."""
-    try:
-        return os.path.getsize(file_path)
-    except OSError:
-        return None
+    st = stat_file(file_path)
+    return st.st_size if st is not None else None
+
+
+def open_for_upload(file_path: str):
+    """Открывает файл для отправки в Telegram с крупным буфером чтения.
+
+    Буфер в 1 МБ вместо стандартных 8 КБ: меньше системных вызовов read()
+    и коротких bytes-объектов при отправке больших видео.
+    """
+    return open(file_path, "rb", buffering=UPLOAD_READ_BUFFER_SIZE)
 
 
 # --- Повторные попытки загрузки ---
 
 
+# Признаки временной ошибки в тексте исключения (один проход вместо шести);
+# коды статуса — целыми словами, чтобы не ловить их внутри чисел и file_id
+_TRANSIENT_ERROR_RE = re.compile(r"timeout|connection|network|\b(?:429|50[23])\b", re.IGNORECASE)
+# Сетевые исключения, которые всегда считаются временными
+_TRANSIENT_ERROR_TYPES = (
+    TimeoutError,
+    ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ConnectionError,
+)
+# Коды ответа Telegram API, при которых имеет смысл повторить запрос
+_TRANSIENT_API_CODES = frozenset({429, 500, 502, 503, 504})
+# Собственный генератор для разброса пауз: не делим состояние модуля random
+_retry_rng = random.Random()
+# Подсказка Telegram при 429: «Too Many Requests: retry after 17»
+_RETRY_AFTER_RE = re.compile(r"retry[_ ]after[:\s]+(\d+)", re.IGNORECASE)
+
+
+def _is_transient_error(exc: Exception) -> bool:
+    """Временная ли ошибка: сначала по типу/коду, текст — только как запасной вариант."""
+    if isinstance(exc, _TRANSIENT_ERROR_TYPES):
+        return True
+    if isinstance(exc, ApiTelegramException):
+        return exc.error_code in _TRANSIENT_API_CODES
+    if isinstance(exc, ApiHTTPException):
+        # Не-JSON ответ (например, 502 от прокси или локального Bot API Server):
+        # решаем по HTTP-статусу, не сканируя тело ответа из текста ошибки
+        return getattr(exc.result, "status_code", None) in _TRANSIENT_API_CODES
+    return _TRANSIENT_ERROR_RE.search(str(exc)) is not None
+
+
+def _retry_after(exc: Exception) -> float | None:
+    """Пауза, которую сам Telegram просит выдержать перед повтором (при 429)."""
+    # ApiTelegramException хранит ответ API целиком: {"parameters": {"retry_after": N}}
+    result_json = getattr(exc, "result_json", None)
+    if isinstance(result_json, dict):
+        retry_after = (result_json.get("parameters") or {}).get("retry_after")
+        if retry_after:
+            return float(retry_after)
+    # Запасной вариант — текст ошибки (другие типы исключений, старые версии)
+    match = _RETRY_AFTER_RE.search(str(exc))
+    if match:
+        return float(match.group(1))
+    return None
+
+
+# Выставляется при остановке бота: паузы между повторами прерываются сразу
+_SHUTDOWN_EVENT = threading.Event()
+
+
+def shutdown_retries() -> None:
+    """Прерывает ожидание повторов отправки (вызывается при остановке бота)."""
+    _SHUTDOWN_EVENT.set()
+
+
 def send_with_retry(send_func, *args, **kwargs):
     """Вызывает send_func с повторными попытками при временных ошибках Telegram."""
     last_exc = None
@@ -157,23 +288,25 @@ def send_with_retry(send_func, *args, **kwargs):
             return send_func(*args, **kwargs)
         except Exception as exc:
             last_exc = exc
-            error_text = str(exc).lower()
-            is_transient = any(
-                token in error_text
-                for token in ("timeout", "connection", "network", "429", "502", "503")
-            )
-            if not is_transient:
+            if not _is_transient_error(exc):
                 raise
             if attempt < UPLOAD_MAX_RETRIES - 1:
-                delay = UPLOAD_RETRY_DELAYS[min(attempt, len(UPLOAD_RETRY_DELAYS) - 1)]
+                retry_after = _retry_after(exc)
+                if retry_after is not None:
+                    # Небольшой разброс, чтобы ожидающие потоки не ударили разом
+                    delay = min(retry_after + _retry_rng.uniform(0, 0.5), UPLOAD_RETRY_AFTER_MAX)
+                else:
+                    delay = min(UPLOAD_RETRY_MAX_DELAY, UPLOAD_RETRY_BASE_DELAY * (2 ** attempt))
+                    delay *= 1 + _retry_rng.uniform(0, UPLOAD_RETRY_JITTER)
                 logging.warning(
-                    "Попытка загрузки %d/%d не удалась: %s, повтор через %dс",
+                    "Попытка загрузки %d/%d не удалась: %s, повтор через %.1fс",
                     attempt + 1,
                     UPLOAD_MAX_RETRIES,
                     exc,
                     delay,
                 )
-                time.sleep(delay)
+                if _SHUTDOWN_EVENT.wait(delay):
+                    break
     raise last_exc
 
 
@@ -206,60 +339,209 @@ def notify_admin_cookies_expired(bot, platform: str) -> None:
             logging.debug("Не удалось уведомить админа %s о cookies", admin_id)
 
 
+_NOTIFY_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="admin-notify")
+
+# Ограничение уведомлений об ошибках при их лавине: токен-бакет на каждого
+# админа (лимит Telegram — около сообщения в секунду на чат) и склейка
+# одинаковых трейсбеков в пределах окна
+_ADMIN_NOTIFY_RATE = 1.0  # токенов в секунду
+_ADMIN_NOTIFY_BURST = 3  # ёмкость бакета
+_ADMIN_NOTIFY_DEDUPE_WINDOW = 60  # секунд
+_admin_notify_lock = threading.Lock()
+_admin_buckets: dict[int, tuple[float, float]] = {}  # admin_id -> (токены, monotonic пополнения)
+_recent_errors: dict[str, float] = {}  # хэш хвоста трейсбека -> monotonic отправки
+_admin_notify_dropped = 0
+
+# Шаблон уведомления об ошибке: собирается один раз при импорте
+_ADMIN_ERROR_TEMPLATE = (
+    f"{EMOJI_ALERT} <b>Ошибка бота</b>\n\n"
+    "\U0001f464 <b>Пользователь:</b> {user}\n"
+    "\U0001f4cb <b>Действие:</b> {action}\n"
+    "\u274c <b>Ошибка:</b> {error}\n\n"
+    "<pre>{tb}</pre>"
+)
+
+
 def notify_admin_error(bot, user_id: int, username: str, action: str, error: Exception) -> None:
     """Отправляет уведомление об ошибке всем админам с контекстом пользователя."""
-    tb = traceback.format_exc()
+    # Некому отправлять (или лимит исчерпан у всех) — не форматируем трейсбек впустую
+    if not ADMIN_IDS or _admin_notify_exhausted():
+        return
+    tb = "".join(traceback.format_exception(type(error), error, error.__traceback__))
     if len(tb) > 800:
         tb = "..." + tb[-800:]
-    message = (
-        f"{EMOJI_ALERT} <b>\u041e\u0448\u0438\u0431\u043a\u0430 \u0431\u043e\u0442\u0430</b>\n\n"
-        f"\U0001f464 <b>\u041f\u043e\u043b\u044c\u0437\u043e\u0432\u0430\u0442\u0435\u043b\u044c:</b> {user_id}"
-    )
-    if username:
-        message += f" (@{username})"
-    message += (
-        f"\n\U0001f4cb <b>\u0414\u0435\u0439\u0441\u0442\u0432\u0438\u0435:</b> {action}"
-        f"\n\u274c <b>\u041e\u0448\u0438\u0431\u043a\u0430:</b> {error}"
-        f"\n\n<pre>{tb}</pre>"
+    recipients = _admin_notify_recipients(tb)
+    if not recipients:
+        return
+    message = _ADMIN_ERROR_TEMPLATE.format(
+        user=f"{user_id} (@{username})" if username else user_id,
+        action=action,
+        error=error,
+        tb=tb,
     )
     # Обрезаем до лимита Telegram
     if len(message) > 4000:
         message = message[:4000] + "..."
-    for admin_id in ADMIN_IDS:
-        try:
-            bot.send_message(admin_id, message, parse_mode="HTML")
-        except Exception:
-            logging.debug("Не удалось уведомить админа %s об ошибке", admin_id)
+    # Отправляем параллельно и не ждём: обработчик пользователя не блокируется
+    # на сумме задержек по всем админам
+    for admin_id in recipients:
+        _NOTIFY_POOL.submit(_send_admin_notification, bot, admin_id, message)
+
+
+def _admin_notify_exhausted() -> bool:
+    """True, если бакеты всех админов пусты — уведомление всё равно не уйдёт."""
+    global _admin_notify_dropped
+    now = time.monotonic()
+    with _admin_notify_lock:
+        for admin_id in ADMIN_IDS:
+            bucket = _admin_buckets.get(admin_id)
+            if bucket is None:
+                return False
+            tokens, refilled = bucket
+            if tokens + (now - refilled) * _ADMIN_NOTIFY_RATE >= 1:
+                return False
+        _admin_notify_dropped += len(ADMIN_IDS)
+        return True
+
+
+def _admin_notify_recipients(tb: str) -> list[int]:
+    """Админы, которым можно отправить уведомление сейчас (дубли и превышение лимита — мимо)."""
+    global _admin_notify_dropped
+    now = time.monotonic()
+    key = hashlib.blake2b(tb[-200:].encode(), digest_size=8).hexdigest()
+    with _admin_notify_lock:
+        for stale in [k for k, sent in _recent_errors.items() if now - sent > _ADMIN_NOTIFY_DEDUPE_WINDOW]:
+            del _recent_errors[stale]
+        if key in _recent_errors:
+            _admin_notify_dropped += len(ADMIN_IDS)
+            return []
+        recipients = []
+        for admin_id in ADMIN_IDS:
+            tokens, refilled = _admin_buckets.get(admin_id, (_ADMIN_NOTIFY_BURST, now))
+            tokens = min(_ADMIN_NOTIFY_BURST, tokens + (now - refilled) * _ADMIN_NOTIFY_RATE)
+            if tokens >= 1:
+                tokens -= 1
+                recipients.append(admin_id)
+            else:
+                _admin_notify_dropped += 1
+            _admin_buckets[admin_id] = (tokens, now)
+        dropped = 0
+        if recipients:
+            _recent_errors[key] = now
+            # О пропущенных сообщаем вместе со следующим отправленным
+            dropped, _admin_notify_dropped = _admin_notify_dropped, 0
+    if dropped:
+        logging.warning("Пропущено уведомлений об ошибках (лимит или повтор): %d", dropped)
+    return recipients
+
+
+def _send_admin_notification(bot, admin_id: int, message: str) -> None:
+    """Отправляет одно уведомление админу, ошибки только логируются."""
+    try:
+        bot.send_message(admin_id, message, parse_mode="HTML")
+    except Exception:
+        logging.debug("Не удалось уведомить админа %s об ошибке", admin_id)
 
 
 # --- Кэш подписок ---
 
+# Число полос (shard) с собственными блокировками; степень двойки — индекс
+# полосы берётся маской от хэша ключа
+_LOCK_SHARDS = 16
+
 
 class MembershipCache:
     """Потокобезопасный кэш проверок подписок для снижения нагрузки на Telegram API."""
 
-    def __init__(self, ttl: int = MEMBERSHIP_CACHE_TTL) -> None:
-        self._cache: dict[tuple[int, int], tuple[bool, float]] = {}
-        self._lock = threading.Lock()
-        self._ttl = ttl
+    def __init__(self, ttl: int = MEMBERSHIP_CACHE_TTL, max_size: int = MEMBERSHIP_CACHE_MAX_SIZE) -> None:
+        # Ключи разнесены по полосам, у каждой свой LRU и своя блокировка:
+        # параллельные проверки разных пользователей не ждут друг друга.
+        # В начале каждого LRU — давно не использованные записи.
+        self._shards: list[OrderedDict[tuple[int, int], tuple[bool, int]]] = [
+            OrderedDict() for _ in range(_LOCK_SHARDS)
+        ]
+        self._locks = [threading.Lock() for _ in range(_LOCK_SHARDS)]
+        # Время хранится в целых наносекундах: без float-объектов на каждую операцию.
+        self._ttl_ns = ttl * 1_000_000_000
+        self._shard_max_size = max(1, max_size // _LOCK_SHARDS)
+        self._sweep_interval = max(ttl, MEMBERSHIP_CACHE_SWEEP_MIN_INTERVAL)
+        self._thread = threading.Thread(target=self._run_sweeper, daemon=True)
+        self._stop_event = threading.Event()
+
+    def start(self) -> None:
+        """Запускает фоновую очистку устаревших записей."""
+        self._thread.start()
+
+    def stop(self, timeout: float = 2.0) -> None:
+        """Останавливает фоновую очистку."""
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+
+    def _run_sweeper(self) -> None:
+        """Основной цикл: ожидание интервала → удаление устаревших записей."""
+        while not self._stop_event.wait(self._sweep_interval):
+            self.sweep()
+
+    def sweep(self) -> int:
+        """Удаляет записи старше TTL (пользователи, которые больше не пишут), возвращает их число."""
+        removed = 0
+        for lock, cache in zip(self._locks, self._shards):
+            now_ns = time.monotonic_ns()
+            # Блокировку держим по одной полосе, а не на весь кэш сразу
+            with lock:
+                expired = [
+                    key for key, (_, timestamp_ns) in cache.items()
+                    if now_ns - timestamp_ns > self._ttl_ns
+                ]
+                for key in expired:
+                    del cache[key]
+            removed += len(expired)
+        return removed
+
+    def _shard(
+        self, key: tuple[int, int],
+    ) -> tuple[threading.Lock, OrderedDict[tuple[int, int], tuple[bool, int]]]:
+        """Блокировка и LRU полосы, в которую попадает ключ."""
+        index = hash(key) & (_LOCK_SHARDS - 1)
+        return self._locks[index], self._shards[index]
 
     def get(self, chat_id: int, user_id: int) -> bool | None:
         """Возвращает кэшированный статус подписки или None, если запись устарела."""
-        with self._lock:
-            key = (chat_id, user_id)
-            entry = self._cache.get(key)
-            if entry is None:
-                return None
-            is_member, timestamp = entry
-            if time.monotonic() - timestamp > self._ttl:
-                del self._cache[key]
-                return None
-            return is_member
+        key = (chat_id, user_id)
+        lock, cache = self._shard(key)
+        # Чтение без блокировки: отдельная операция над dict атомарна под GIL.
+        # Гонка с параллельным set может вернуть значение на мгновение
+        # старше только что записанного — для кэша подписок это допустимо.
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        is_member, timestamp_ns = entry
+        if time.monotonic_ns() - timestamp_ns > self._ttl_ns:
+            with lock:
+                # Удаляем, только если запись не успели обновить
+                if cache.get(key) is entry:
+                    del cache[key]
+            return None
+        # Обновление LRU — по возможности: занятую полосу не ждём
+        if lock.acquire(blocking=False):
+            try:
+                if key in cache:
+                    cache.move_to_end(key)
+            finally:
+                lock.release()
+        return is_member
 
     def set(self, chat_id: int, user_id: int, is_member: bool) -> None:
-        """Сохраняет статус подписки в кэш."""
-        with self._lock:
-            self._cache[(chat_id, user_id)] = (is_member, time.monotonic())
+        """Сохраняет статус подписки в кэш (при переполнении вытесняет давно не использованные)."""
+        key = (chat_id, user_id)
+        now_ns = time.monotonic_ns()
+        lock, cache = self._shard(key)
+        with lock:
+            cache[key] = (is_member, now_ns)
+            cache.move_to_end(key)
+            while len(cache) > self._shard_max_size:
+                cache.popitem(last=False)
 
 
 # --- Дедупликация загрузок ---
@@ -269,27 +551,49 @@ class ActiveDownloads:
     """Отслеживает активные загрузки для предотвращения дублей по одному URL."""
 
     def __init__(self) -> None:
-        self._active: dict[str, int] = {}
-        self._lock = threading.Lock()
+        # Повторный захват того же URL запрещён, поэтому счётчик не нужен —
+        # URL либо скачивается, либо нет. Полосы — как в MembershipCache.
+        self._shards: list[set[str]] = [set() for _ in range(_LOCK_SHARDS)]
+        self._locks = [threading.Lock() for _ in range(_LOCK_SHARDS)]
+
+    def _shard(self, url: str) -> tuple[threading.Lock, set[str]]:
+        """Блокировка и множество полосы, в которую попадает URL."""
+        index = hash(url) & (_LOCK_SHARDS - 1)
+        return self._locks[index], self._shards[index]
 
     def try_acquire(self, url: str) -> bool:
         """Пытается занять URL для загрузки. Возвращает False, если уже скачивается."""
-        with self._lock:
-            if self._active.get(url, 0) > 0:
+        lock, active = self._shard(url)
+        with lock:
+            if url in active:
                 return False
-            self._active[url] = self._active.get(url, 0) + 1
+            active.add(url)
             return True
 
     def release(self, url: str) -> None:
         """Освобождает URL после завершения загрузки."""
-        with self._lock:
-            count = self._active.get(url, 0)
-            if count <= 1:
-                self._active.pop(url, None)
-            else:
-                self._active[url] = count - 1
+        lock, active = self._shard(url)
+        with lock:
+            active.discard(url)
+
+    @contextmanager
+    def acquire(self, url: str) -> Iterator[bool]:
+        """Занимает URL на время блока with; отдаёт False, если он уже скачивается.
+
+        Освобождает URL при выходе из блока, только если захват удался.
+        """
+        acquired = self.try_acquire(url)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self.release(url)
 
     def is_active(self, url: str) -> bool:
-        """Проверяет, скачивается ли данный URL в данный момент."""
-        with self._lock:
-            return self._active.get(url, 0) > 0
+        """Проверяет, скачивается ли данный URL в данный момент.
+
+        Без блокировки: проверка вхождения в set атомарна под GIL, результат
+        может отставать от параллельного try_acquire/release на мгновение.
+        Для захвата URL используйте try_acquire.
+        """
+        return url in self._shards[hash(url) & (_LOCK_SHARDS - 1)]